@@ -0,0 +1,306 @@
+"""
+Local stand-in for the Synology Photos web api, serving a synthetic library. It implements the entry.cgi endpoints used
+by synophotos (login, browse/count/get for albums, folders and items, downloads, thumbnails, album creation and sharing)
+and allows to simulate network latency and server side page limits.
+
+Usage: python benchmarks/fakeserver.py [--items 100000] [--folders 10000] [--latency 0.005] [--port 5000]
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from io import BytesIO
+from json import dumps, loads
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socket import IPPROTO_TCP, TCP_NODELAY
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from zipfile import ZIP_STORED, ZipFile
+
+from attrs import define, field
+
+ROOT_ID = 1
+SID = 'fake-sid'
+
+EXIF = [
+	{ 'key': 'Make', 'value': 'Fake' }, { 'key': 'Date and Time', 'value': '2022:01:30 16:50:46' }, { 'key': 'Offset Time', 'value': '+01:00' },
+	{ 'key': 'GPS Latitude', 'value': "52deg 30' 31\"" }, { 'key': 'GPS Latitude Reference', 'value': 'North' },
+	{ 'key': 'GPS Longitude', 'value': "13deg 20' 15\"" }, { 'key': 'GPS Longitude Reference', 'value': 'East' },
+]
+
+JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xda'
+
+@define
+class Library:
+	"""
+	Synthetic library: folders form a tree with the provided fan-out below the root folder, items are distributed evenly
+	among all folders and albums contain consecutive ranges of items.
+	"""
+
+	items: int = field( default=1000 )
+	folders: int = field( default=100 )
+	albums: int = field( default=10 )
+	album_size: int = field( default=100 )
+	fanout: int = field( default=10 )
+	item_size: int = field( default=64 * 1024 )
+
+	folder_list: List[Dict] = field( init=False, factory=list )
+	children: Dict[int, List[Dict]] = field( init=False, factory=dict )
+	folder_items: Dict[int, List[Dict]] = field( init=False, factory=dict )
+	item_map: Dict[int, Dict] = field( init=False, factory=dict )
+	album_list: List[Dict] = field( init=False, factory=list )
+	album_items: Dict[int, List[Dict]] = field( init=False, factory=dict )
+	content: bytes = field( init=False, default=b'' )
+
+	def __attrs_post_init__( self ):
+		root = { 'id': ROOT_ID, 'name': '/', 'parent': ROOT_ID, 'owner_user_id': 1, 'passphrase': '', 'shared': False, 'sort_by': 'default', 'sort_direction': 'default' }
+		self.folder_list = [ root ]
+		for index in range( 1, self.folders + 1 ):
+			parent = self.folder_list[( index - 1 ) // self.fanout if index > self.fanout else 0]
+			name = f'{parent["name"].rstrip( "/" )}/folder_{index}'
+			self.folder_list.append( { **root, 'id': ROOT_ID + index, 'name': name, 'parent': parent['id'] } )
+		for f in self.folder_list:
+			if f['id'] != ROOT_ID:
+				self.children.setdefault( f['parent'], [] ).append( f )
+			self.folder_items[f['id']] = []
+
+		for index in range( 1, self.items + 1 ):
+			folder = self.folder_list[index % len( self.folder_list )]
+			time = 1_600_000_000 + index
+			item = {
+				'id': index, 'filename': f'IMG_{index:07d}.jpg', 'filesize': self.item_size, 'folder_id': folder['id'], 'owner_user_id': 1,
+				'time': time, 'indexed_time': time * 1000, 'type': 'photo', 'live_type': 'none',
+				'additional': { 'thumbnail': { 'cache_key': f'{index}_{time}', 'm': 'ready', 'sm': 'ready', 'xl': 'ready', 'unit_id': index } },
+			}
+			self.item_map[index] = item
+			self.folder_items[folder['id']].append( item )
+
+		for index in range( 1, self.albums + 1 ):
+			items = [ self.item_map[i] for i in range( ( index - 1 ) * self.album_size + 1, index * self.album_size + 1 ) if i in self.item_map ]
+			self.album_list.append( self.album( index, f'album {index}', items ) )
+			self.album_items[index] = items
+
+		# content starts like a jpeg file (SOI, APP0, SOS), so that exif data can be written into it
+		filler = bytes( range( 256 ) ) * ( self.item_size // 256 ) + bytes( self.item_size % 256 )
+		self.content = ( JPEG_HEADER + filler )[:self.item_size]
+
+	def album( self, id: int, name: str, items: List[Dict] ) -> Dict:
+		return {
+			'id': id, 'name': name, 'item_count': len( items ), 'owner_user_id': 1, 'passphrase': '', 'shared': False, 'temporary_shared': False,
+			'create_time': 1_600_000_000, 'start_time': 1_600_000_000, 'end_time': 1_600_000_000, 'type': 'normal', 'version': 1, 'sort_by': 'default', 'sort_direction': 'default',
+		}
+
+@define
+class FakeServer:
+
+	library: Library = field( factory=Library )
+	latency: float = field( default=0.0 ) # seconds added to each request
+	page_limit: int = field( default=5000 ) # maximum number of elements returned per page, regardless of the requested limit
+	host: str = field( default='127.0.0.1' )
+	port: int = field( default=0 )
+
+	requests: Counter = field( init=False, factory=Counter )
+	_httpd: Optional[ThreadingHTTPServer] = field( init=False, default=None )
+	_lock: Lock = field( init=False, factory=Lock )
+
+	@property
+	def url( self ) -> str:
+		return f'http://{self.host}:{self._httpd.server_port}'
+
+	def start( self ) -> 'FakeServer':
+		server = self
+
+		class Handler( FakeHandler ):
+			fake = server
+
+		self._httpd = ThreadingHTTPServer( ( self.host, self.port ), Handler )
+		self._httpd.daemon_threads = True
+		Thread( target=self._httpd.serve_forever, daemon=True ).start()
+		return self
+
+	def stop( self ) -> None:
+		self._httpd.shutdown()
+		self._httpd.server_close()
+
+	def __enter__( self ):
+		return self.start()
+
+	def __exit__( self, *args ):
+		self.stop()
+
+	def count( self, api: str, method: str ) -> None:
+		with self._lock:
+			self.requests[f'{api}.{method}'] += 1
+
+	# request handling, returns status, headers and body
+
+	def handle( self, params: Dict[str, str], headers: Dict[str, str] ) -> Tuple[int, Dict[str, str], bytes]:
+		if self.latency:
+			sleep( self.latency )
+
+		api, method = params.get( 'api', '' ), params.get( 'method', '' )
+		self.count( api, method )
+
+		if api == 'SYNO.API.Auth':
+			return self.success( { 'sid': SID, 'device_id': 'fake-device', 'is_portal_port': False, 'account': params.get( 'account' ) } )
+		if params.get( '_sid' ) != SID:
+			return self.error( 119 )
+
+		if api == 'SYNO.Foto.Download':
+			return self.download( params, headers )
+		if api == 'SYNO.Foto.Thumbnail':
+			return 200, { 'Content-Type': 'image/jpeg' }, self.library.content[:4096]
+
+		# SYNO.Foto.Browse.Folder + list -> browse_folder_list()
+		handler = getattr( self, '_'.join( [ *api.lower().split( '.' )[-2:], method ] ), None )
+		return handler( params ) if handler else self.error( 103 )
+
+	def browse_folder_get( self, params: Dict ) -> Tuple:
+		folder_id = int( params.get( 'id' ) or 0 ) or ROOT_ID
+		return self.success( { 'folder': self.library.folder_list[folder_id - ROOT_ID] } )
+
+	def browse_folder_list( self, params: Dict ) -> Tuple:
+		return self.page( self.library.children.get( int( params.get( 'id' ) or 0 ) or ROOT_ID, [] ), params )
+
+	def browse_folder_count( self, params: Dict ) -> Tuple:
+		return self.success( { 'count': len( self.library.children.get( int( params.get( 'id' ) or 0 ) or ROOT_ID, [] ) ) } )
+
+	def browse_item_list( self, params: Dict ) -> Tuple:
+		return self.page( self.items( params ), params, 'thumbnail' in params.get( 'additional', '' ) )
+
+	def browse_item_count( self, params: Dict ) -> Tuple:
+		return self.success( { 'count': len( self.items( params ) ) } )
+
+	def browse_item_get( self, params: Dict ) -> Tuple:
+		return self.success( { 'list': [ self.library.item_map[i] for i in loads( params.get( 'id', '[]' ) ) if i in self.library.item_map ] } )
+
+	def browse_item_get_exif( self, params: Dict ) -> Tuple:
+		return self.success( { 'list': [ { 'id': i, 'exif': EXIF } for i in loads( params.get( 'id', '[]' ) ) ] } )
+
+	def browse_album_list( self, params: Dict ) -> Tuple:
+		return self.page( self.library.album_list, params, True )
+
+	def browse_album_count( self, params: Dict ) -> Tuple:
+		return self.success( { 'count': len( self.library.album_list ) } )
+
+	def browse_album_get( self, params: Dict ) -> Tuple:
+		ids = loads( params.get( 'id', '[]' ) )
+		return self.success( { 'list': [ a for a in self.library.album_list if a['id'] in ids ] } )
+
+	def browse_normalalbum_create( self, params: Dict ) -> Tuple:
+		with self._lock:
+			album = self.library.album( len( self.library.album_list ) + 1, params.get( 'name' ), [] )
+			self.library.album_list.append( album )
+			self.library.album_items[album['id']] = []
+		return self.success( { 'album': album } )
+
+	def browse_normalalbum_add_item( self, params: Dict ) -> Tuple:
+		album_id = int( params.get( 'id' ) )
+		with self._lock:
+			items = self.library.album_items.setdefault( album_id, [] )
+			known = { i['id'] for i in items }
+			items.extend( self.library.item_map[i] for i in loads( params.get( 'item', '[]' ) ) if i in self.library.item_map and i not in known )
+			for album in self.library.album_list:
+				if album['id'] == album_id:
+					album['item_count'], album['version'] = len( items ), album['version'] + 1
+		return self.success( {} )
+
+	def sharing_passphrase_set_shared( self, params: Dict ) -> Tuple:
+		return self.success( { 'passphrase': f'fake-{params.get( "album_id" )}' } )
+
+	def sharing_passphrase_update( self, params: Dict ) -> Tuple:
+		return self.success( {} )
+
+	def sharing_misc_list_user_group( self, params: Dict ) -> Tuple:
+		return self.success( { 'list': [ { 'id': 1, 'name': 'admin', 'type': 'user' }, { 'id': 2, 'name': 'users', 'type': 'group' } ] } )
+
+	def download( self, params: Dict, headers: Dict ) -> Tuple:
+		ids = [ i for i in loads( params.get( 'item_id', '[]' ) ) if i in self.library.item_map ]
+		if not ids:
+			return self.error( 120 )
+
+		content = self.library.content
+		if len( ids ) > 1:
+			archive = BytesIO()
+			with ZipFile( archive, 'w', ZIP_STORED ) as zf:
+				for i in ids:
+					zf.writestr( self.library.item_map[i]['filename'], content )
+			return 200, { 'Content-Type': 'application/zip' }, archive.getvalue()
+
+		if ( range_header := headers.get( 'Range' ) ) and range_header.startswith( 'bytes=' ):
+			offset = int( range_header[6:].split( '-' )[0] or 0 )
+			if offset >= len( content ):
+				return 416, { 'Content-Range': f'bytes */{len( content )}' }, b''
+			return 206, { 'Content-Type': 'image/jpeg', 'Content-Range': f'bytes {offset}-{len( content ) - 1}/{len( content )}' }, content[offset:]
+		return 200, { 'Content-Type': 'image/jpeg' }, content
+
+	# helpers
+
+	def items( self, params: Dict ) -> List[Dict]:
+		if folder_id := params.get( 'folder_id' ):
+			return self.library.folder_items.get( int( folder_id ), [] )
+		if album_id := params.get( 'album_id' ):
+			return self.library.album_items.get( int( album_id ), [] )
+		return list( self.library.item_map.values() )
+
+	def page( self, elements: List[Dict], params: Dict, additional: bool = False ) -> Tuple:
+		offset, limit = int( params.get( 'offset', 0 ) ), min( int( params.get( 'limit', self.page_limit ) ), self.page_limit )
+		page = elements[offset:offset + limit]
+		if not additional:
+			page = [ { k: v for k, v in e.items() if k != 'additional' } for e in page ]
+		return self.success( { 'list': page } )
+
+	def success( self, data: Dict ) -> Tuple:
+		return 200, { 'Content-Type': 'application/json' }, dumps( { 'success': True, 'data': data } ).encode()
+
+	def error( self, code: int ) -> Tuple:
+		return 200, { 'Content-Type': 'application/json' }, dumps( { 'success': False, 'error': { 'code': code } } ).encode()
+
+class FakeHandler( BaseHTTPRequestHandler ):
+
+	protocol_version = 'HTTP/1.1'
+	fake: FakeServer = None
+
+	def setup( self ):
+		super().setup()
+		# headers and body are written separately, without this nagle's algorithm delays each response
+		self.request.setsockopt( IPPROTO_TCP, TCP_NODELAY, 1 )
+
+	def log_message( self, *args ):
+		pass
+
+	def do_GET( self ):
+		self.respond( { k: v[0] for k, v in parse_qs( urlparse( self.path ).query ).items() } )
+
+	def do_POST( self ):
+		body = self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) ).decode()
+		self.respond( { k: v[0] for k, v in { **parse_qs( urlparse( self.path ).query ), **parse_qs( body ) }.items() } )
+
+	def respond( self, params: Dict[str, str] ):
+		status, headers, body = self.fake.handle( params, dict( self.headers ) )
+		self.send_response( status )
+		for k, v in headers.items():
+			self.send_header( k, v )
+		self.send_header( 'Content-Length', str( len( body ) ) )
+		self.end_headers()
+		self.wfile.write( body )
+
+if __name__ == '__main__':
+	parser = ArgumentParser( description='runs a fake Synology Photos server with a synthetic library' )
+	parser.add_argument( '--items', type=int, default=100_000 )
+	parser.add_argument( '--folders', type=int, default=10_000 )
+	parser.add_argument( '--albums', type=int, default=100 )
+	parser.add_argument( '--latency', type=float, default=0.0, help='seconds added to each request' )
+	parser.add_argument( '--page-limit', type=int, default=5000 )
+	parser.add_argument( '--port', type=int, default=5000 )
+	args = parser.parse_args()
+
+	library = Library( items=args.items, folders=args.folders, albums=args.albums )
+	server = FakeServer( library=library, latency=args.latency, page_limit=args.page_limit, port=args.port ).start()
+	print( f'serving {args.items} items in {args.folders} folders at {server.url}, press ctrl-c to stop' )
+	try:
+		while True:
+			sleep( 1 )
+	except KeyboardInterrupt:
+		server.stop()
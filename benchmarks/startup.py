@@ -0,0 +1,58 @@
+"""
+Measures how long it takes to start synophotos: the import time of the cli module and the wall time of running commands
+which do not talk to the server. Each measurement runs in a fresh interpreter, the median of all runs is reported. Also
+reports which expensive modules have been imported, so that eager imports creeping back in are easy to spot.
+
+Exits with status 1 if the median import time exceeds the budget.
+
+Usage: python benchmarks/startup.py [--runs 20] [--budget 0.25]
+"""
+
+from argparse import ArgumentParser
+from os import environ
+from statistics import median
+from subprocess import run
+from sys import executable, exit as sysexit
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import List
+
+# modules which should only be imported by commands actually needing them
+EXPENSIVE_MODULES = [ 'aiohttp', 'fs', 'fs.osfs', 'requests', 'rich.logging', 'rich.progress', 'rich.table', 'sqlite3' ]
+
+IMPORT_CODE = 'from time import perf_counter; s = perf_counter(); import synophotos.cli; print( perf_counter() - s )'
+MODULES_CODE = f'import sys; import synophotos.cli; print( " ".join( m for m in {EXPENSIVE_MODULES!r} if m in sys.modules ) )'
+COMMANDS = [ [ 'version' ], [ '--help' ] ]
+
+def python( code: str, env: dict ) -> str:
+	return run( [ executable, '-c', code ], env=env, capture_output=True, text=True, check=True ).stdout.strip()
+
+def command( args: List[str], env: dict ) -> float:
+	start = perf_counter()
+	run( [ executable, '-m', 'synophotos', *args ], env=env, capture_output=True, check=True )
+	return perf_counter() - start
+
+def main():
+	parser = ArgumentParser( description='measures startup time of synophotos' )
+	parser.add_argument( '--runs', type=int, default=20 )
+	parser.add_argument( '--budget', type=float, default=0.25, help='maximum median import time in seconds' )
+	args = parser.parse_args()
+
+	# use an empty configuration directory, so that results do not depend on the configuration of the current user
+	env = environ | { 'XDG_CONFIG_HOME': mkdtemp( prefix='synophotos-bench-' ), 'PYTHONDONTWRITEBYTECODE': '' }
+
+	python( IMPORT_CODE, env ) # warm up bytecode and filesystem caches
+	imports = median( float( python( IMPORT_CODE, env ) ) for _ in range( args.runs ) )
+	print( f'{"import synophotos.cli":<32} {imports * 1000:>8.1f} ms' )
+	for cmd in COMMANDS:
+		seconds = median( command( cmd, env ) for _ in range( args.runs ) )
+		print( f'{"synophotos " + " ".join( cmd ):<32} {seconds * 1000:>8.1f} ms' )
+
+	print( f'{"expensive modules imported":<32} {python( MODULES_CODE, env ) or "none"}' )
+
+	if imports > args.budget:
+		print( f'import time exceeds budget of {args.budget * 1000:.0f} ms' )
+		sysexit( 1 )
+
+if __name__ == '__main__':
+	main()
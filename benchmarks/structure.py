@@ -0,0 +1,35 @@
+"""
+Micro-benchmark comparing the generic cattrs structuring of items with the pre-generated structure functions.
+
+Usage: python benchmarks/structure.py [count]
+"""
+
+from sys import argv
+from timeit import timeit
+
+from synophotos.photos import Album, Item
+from synophotos.webservice import STRUCTURE_FNS, conv
+
+def items( count: int ):
+	return [ {
+		'filename': f'IMG_{i:06d}.jpg', 'filesize': 2_000_000 + i, 'folder_id': i % 100, 'id': i, 'owner_user_id': 2,
+		'time': 1_600_000_000 + i, 'indexed_time': 1_600_000_000_000 + i, 'type': 'photo', 'live_type': '',
+	} for i in range( count ) ]
+
+def items_with_thumbnails( count: int ):
+	return [ { **i, 'additional': { 'thumbnail': { 'cache_key': f'{i["id"]}_1600000000', 'sm': 'ready', 'm': 'ready', 'xl': 'ready' } } } for i in items( count ) ]
+
+def albums( count: int ):
+	return [ { 'id': i, 'name': f'album {i}', 'item_count': i, 'owner_user_id': 2, 'version': 1 } for i in range( count ) ]
+
+def run( name: str, cls, data, repeat: int = 5 ) -> None:
+	fast = STRUCTURE_FNS[cls]
+	generic = min( timeit( lambda: [ conv.structure( e, cls ) for e in sorted( data, key=lambda e: e.get( 'id' ) ) ], number=1 ) for _ in range( repeat ) )
+	generated = min( timeit( lambda: [ fast( e ) for e in data ], number=1 ) for _ in range( repeat ) )
+	print( f'{name:<24} cattrs: {len( data ) / generic:>12,.0f}/s   generated: {len( data ) / generated:>12,.0f}/s   speedup: {generic / generated:.1f}x' )
+
+if __name__ == '__main__':
+	count = int( argv[1] ) if len( argv ) > 1 else 100_000
+	run( 'items', Item, items( count ) )
+	run( 'items with thumbnails', Item, items_with_thumbnails( count ) )
+	run( 'albums', Album, albums( count ) )
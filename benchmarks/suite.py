@@ -0,0 +1,164 @@
+"""
+Benchmark suite running synophotos against the fake server from fakeserver.py. Covers listing, recursive traversal,
+sync planning, exif fetching and download throughput (with and without writing exif data). Results are printed as table
+and written as json, so that runs can be compared.
+
+Usage: python benchmarks/suite.py [--items 100000] [--folders 10000] [--latency 0.002] [--output results.json] [benchmark ...]
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from json import dumps
+from os import makedirs
+from os.path import dirname, join
+from platform import platform, python_version
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+from attrs import asdict, define, field
+from fs.osfs import OSFS
+
+from fakeserver import FakeServer, Library, ROOT_ID
+from synophotos import __version__
+from synophotos.downloader import download_items
+from synophotos.fsio import prepare_sync_albums
+from synophotos.photos import Album, Item, SynoPhotos
+
+@define
+class Result:
+
+	name: str = field( default=None )
+	seconds: float = field( default=0.0 )
+	operations: int = field( default=0 ) # number of processed elements (items, folders or bytes)
+	unit: str = field( default='items' )
+	requests: int = field( default=0 ) # number of requests the server received
+	rate: float = field( default=0.0 ) # operations per second
+
+@define
+class Suite:
+
+	server: FakeServer = field( default=None )
+	concurrency: int = field( default=4 )
+	jobs: int = field( default=4 )
+	downloads: int = field( default=500 )
+
+	def service( self ) -> SynoPhotos:
+		synophotos = SynoPhotos( url=self.server.url, account='bench', password='bench', concurrency=self.concurrency )
+		synophotos.login( None )
+		return synophotos
+
+	def measure( self, name: str, unit: str, fn: Callable[..., int], setup: Callable[[SynoPhotos], Any] = None ) -> Result:
+		# setup runs before the clock is started, its result is passed to fn
+		synophotos = self.service()
+		args = [ setup( synophotos ) ] if setup else []
+		requests = sum( self.server.requests.values() )
+		start = perf_counter()
+		operations = fn( synophotos, *args )
+		seconds = perf_counter() - start
+		synophotos.transport.close()
+		requests = sum( self.server.requests.values() ) - requests
+		return Result( name=name, seconds=seconds, operations=operations, unit=unit, requests=requests, rate=operations / seconds if seconds else 0.0 )
+
+	# benchmarks
+
+	def list_items( self, synophotos: SynoPhotos ) -> int:
+		return len( synophotos.list_items( folder_id=ROOT_ID, recursive=True ) )
+
+	def iter_items( self, synophotos: SynoPhotos ) -> int:
+		return sum( 1 for _ in synophotos.iter_items( folder_id=ROOT_ID, recursive=True ) )
+
+	def recursive_folders( self, synophotos: SynoPhotos ) -> int:
+		return len( synophotos.list_folders( ROOT_ID, recursive=True ) )
+
+	def album_items( self, synophotos: SynoPhotos ) -> int:
+		return sum( len( synophotos.list_album_items( a.id ) ) for a in synophotos.list_albums( include_shared=True ) )
+
+	def sync_planning( self, synophotos: SynoPhotos ) -> int:
+		# listing album items is part of planning a sync, half of the items exist in the destination already
+		albums = { a: synophotos.list_album_items( a.id ) for a in synophotos.list_albums( include_shared=True ) }
+		destination = mkdtemp( prefix='synophotos-bench-' )
+		try:
+			for items in albums.values():
+				for item in items[::2]:
+					makedirs( join( destination, str( item.folder_id ) ), exist_ok=True )
+					open( join( destination, str( item.folder_id ), item.filename ), 'wb' ).close()
+			prepare_sync_albums( albums, destination )
+			return sum( len( items ) for items in albums.values() )
+		finally:
+			rmtree( destination )
+
+	def exif( self, synophotos: SynoPhotos, items: List[Item] ) -> int:
+		return len( synophotos.list_exif( items ) )
+
+	def download_setup( self, synophotos: SynoPhotos ) -> List[Item]:
+		return synophotos.list_items( folder_id=ROOT_ID, recursive=True )[:self.downloads]
+
+	def download( self, synophotos: SynoPhotos, items: List[Item], batch_size: int, include_exif: bool = False ) -> int:
+		destination = mkdtemp( prefix='synophotos-bench-' )
+		try:
+			result = download_items( synophotos, [ ( i, Album() ) for i in items ], OSFS( destination ), jobs=self.jobs, thumbnail='original', batch_size=batch_size, include_exif=include_exif )
+			return sum( i.filesize for i in result.downloads )
+		finally:
+			rmtree( destination )
+
+	def benchmarks( self ) -> Dict[str, Callable[[], Result]]:
+		return {
+			'list_items': lambda: self.measure( 'list_items', 'items', self.list_items ),
+			'iter_items': lambda: self.measure( 'iter_items', 'items', self.iter_items ),
+			'recursive_folders': lambda: self.measure( 'recursive_folders', 'folders', self.recursive_folders ),
+			'album_items': lambda: self.measure( 'album_items', 'items', self.album_items ),
+			'sync_planning': lambda: self.measure( 'sync_planning', 'items', self.sync_planning ),
+			'exif': lambda: self.measure( 'exif', 'items', self.exif, lambda s: s.list_items( folder_id=ROOT_ID, recursive=True ) ),
+			'download': lambda: self.measure( 'download', 'bytes', lambda s, i: self.download( s, i, 1 ), self.download_setup ),
+			'download_batched': lambda: self.measure( 'download_batched', 'bytes', lambda s, i: self.download( s, i, 20 ), self.download_setup ),
+			'download_exif': lambda: self.measure( 'download_exif', 'bytes', lambda s, i: self.download( s, i, 20, True ), self.download_setup ),
+		}
+
+	def run( self, names: List[str] ) -> List[Result]:
+		benchmarks = self.benchmarks()
+		return [ benchmarks[name]() for name in ( names or benchmarks.keys() ) ]
+
+def main():
+	parser = ArgumentParser( description='runs synophotos benchmarks against a fake server' )
+	parser.add_argument( '--items', type=int, default=10_000 )
+	parser.add_argument( '--folders', type=int, default=1_000 )
+	parser.add_argument( '--albums', type=int, default=20 )
+	parser.add_argument( '--album-size', type=int, default=500 )
+	parser.add_argument( '--item-size', type=int, default=256 * 1024 )
+	parser.add_argument( '--latency', type=float, default=0.002, help='seconds added to each request' )
+	parser.add_argument( '--page-limit', type=int, default=5000 )
+	parser.add_argument( '--concurrency', type=int, default=4 )
+	parser.add_argument( '--jobs', type=int, default=4 )
+	parser.add_argument( '--downloads', type=int, default=500, help='number of items to download' )
+	parser.add_argument( '--output', default=None, help='file to write json results to' )
+	parser.add_argument( 'benchmarks', nargs='*', help='benchmarks to run, all by default' )
+	args = parser.parse_args()
+
+	library = Library( items=args.items, folders=args.folders, albums=args.albums, album_size=args.album_size, item_size=args.item_size )
+	with FakeServer( library=library, latency=args.latency, page_limit=args.page_limit ) as server:
+		suite = Suite( server=server, concurrency=args.concurrency, jobs=args.jobs, downloads=args.downloads )
+		results = suite.run( args.benchmarks )
+
+	for r in results:
+		print( f'{r.name:<20} {r.seconds:>8.3f}s {r.operations:>12,} {r.unit:<8} {r.rate:>14,.0f} {r.unit}/s {r.requests:>8,} requests' )
+
+	report = {
+		'version': __version__,
+		'timestamp': datetime.now( timezone.utc ).isoformat(),
+		'python': python_version(),
+		'platform': platform(),
+		'parameters': { k: v for k, v in vars( args ).items() if k not in [ 'output', 'benchmarks' ] },
+		'results': [ asdict( r ) for r in results ],
+	}
+	if args.output:
+		if dirname( args.output ):
+			makedirs( dirname( args.output ), exist_ok=True )
+		with open( args.output, 'w' ) as f:
+			f.write( dumps( report, indent=2 ) )
+	else:
+		print( dumps( report, indent=2 ) )
+
+if __name__ == '__main__':
+	main()
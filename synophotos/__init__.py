@@ -1,20 +1,25 @@
 """Synophotos - Synology Photos Command Line Interface"""
 
-from logging import DEBUG, INFO, WARNING, getLogger
+from datetime import timedelta
+from logging import DEBUG, INFO, WARNING, Handler, getLogger
+from os import O_CREAT, O_TRUNC, O_WRONLY, chmod, fdopen, makedirs, open as os_open, replace
+from os.path import exists, expandvars, join
 from sys import exit as sysexit
-from typing import Dict, Optional, Type, TypeVar
+from typing import TYPE_CHECKING, Dict, Optional, Type, TypeVar
 
-from attrs import define, field
+from attrs import asdict, define, field
 from cattrs.preconf.pyyaml import make_converter
 from click import get_current_context
-from fs.errors import ResourceNotFound
-from fs.osfs import OSFS
 from platformdirs import user_config_dir
-from rich.logging import RichHandler
+from yaml import safe_dump, safe_load
 
-from synophotos.cache import Cache, dumps as dump_cache, loads as load_cache
-from synophotos.ui import dataclass_table
-from synophotos.webservice import SynoSession, WebService
+from synophotos.cache import Cache, loads as load_legacy_cache
+from synophotos.limiter import AdaptiveLimiter, DEFAULT_MAX_REQUESTS, DEFAULT_MIN_REQUESTS
+from synophotos.ui import print_stats
+from synophotos.webservice import DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE, SynoSession, WebService
+
+if TYPE_CHECKING:
+	from synophotos.index import MetadataIndex # imports sqlite3, which is only needed when the index is enabled
 
 __version__ = '0.2.3'
 
@@ -25,11 +30,13 @@ T = TypeVar('T')
 APPNAME = 'synophotos'
 
 CFG_DIR = user_config_dir( appname=APPNAME, roaming=True )
-CFG_FS = OSFS( root_path=CFG_DIR, create=True, expand_vars=True )
 
 CONFIG_FILE = 'config.yaml'
 SESSIONS_FILE = 'sessions.yaml'
-CACHE_FILE = 'cache.yaml'
+CACHE_FILE = 'cache.yaml' # legacy cache file, only used for migration
+CACHE_JOURNAL_FILE = 'cache.journal'
+INDEX_FILE = 'index_{profile}.db'
+INDEX_MAX_AGE = timedelta( hours=1 ) # default age after which indexed data is fetched again
 
 DEFAULT_CONFIG = {
 	'profile': 'sample_profile',
@@ -44,16 +51,48 @@ DEFAULT_CONFIG = {
 
 CONVERTER = make_converter()
 
-# logging
-
-DISABLE = 100
-DEFAULT_HANDLER = RichHandler( level=WARNING, show_time=False, show_level=False, markup=True )
-VERBOSE_HANDLER = RichHandler( level=INFO, show_time=True, show_level=False, markup=True, log_time_format='%H:%M:%S' )
-DEBUG_HANDLER = RichHandler( level=DEBUG, show_time=True, show_level=True, markup=True, log_time_format='%H:%M:%S.%f', omit_repeated_times=False )
-
-log.addHandler( DEFAULT_HANDLER )
-log.addHandler( VERBOSE_HANDLER )
-log.addHandler( DEBUG_HANDLER )
+# logging, the handler is set up by the application context
+
+LOG_HANDLER: Optional[Handler] = None
+
+def __getattr__( name: str ):
+	# the config filesystem is created on first access only, as importing fs is expensive
+	if name == 'CFG_FS':
+		from fs.osfs import OSFS
+		globals()['CFG_FS'] = OSFS( root_path=CFG_DIR, create=True, expand_vars=True )
+		return globals()['CFG_FS']
+	raise AttributeError( f'module {__name__!r} has no attribute {name!r}' )
+
+def cfg_path( filename: str ) -> str:
+	return join( expandvars( CFG_DIR ), filename )
+
+def _read_text( filename: str ) -> str:
+	with open( cfg_path( filename ), encoding='UTF-8' ) as f:
+		return f.read()
+
+def log_handler( debug: bool, verbose: bool ) -> Handler:
+	from rich.logging import RichHandler
+	if debug:
+		return RichHandler( level=DEBUG, show_time=True, show_level=True, markup=True, log_time_format='%H:%M:%S.%f', omit_repeated_times=False )
+	elif verbose:
+		return RichHandler( level=INFO, show_time=True, show_level=False, markup=True, log_time_format='%H:%M:%S' )
+	else:
+		return RichHandler( level=WARNING, show_time=False, show_level=False, markup=True )
+
+class DeferredHandler( Handler ):
+	"""
+	Creates the actual handler when the first record is emitted, so that commands which do not log never import rich.logging.
+	"""
+
+	def __init__( self, debug: bool, verbose: bool ):
+		super().__init__( level=DEBUG if debug else INFO if verbose else WARNING )
+		self.debug, self.verbose = debug, verbose
+		self.handler: Optional[Handler] = None
+
+	def emit( self, record ) -> None:
+		if self.handler is None:
+			self.handler = log_handler( self.debug, self.verbose )
+		self.handler.handle( record )
 
 @define
 class Profile:
@@ -62,6 +101,13 @@ class Profile:
 	account: str = field( default=None )
 	password: str = field( default=None )
 
+	pool_size: int = field( default=DEFAULT_POOL_SIZE ) # number of keep-alive connections to the server
+	concurrency: int = field( default=DEFAULT_CONCURRENCY ) # number of concurrent requests when fetching pages
+
+	adaptive: bool = field( default=True ) # adapt the number of requests in flight to the load of the server
+	min_requests: int = field( default=DEFAULT_MIN_REQUESTS ) # lower bound of requests in flight
+	max_requests: int = field( default=DEFAULT_MAX_REQUESTS ) # upper bound of requests in flight, also used when adaptive is off
+
 @define
 class Config:
 
@@ -70,6 +116,8 @@ class Config:
 	verbose: bool = field( default=False )
 
 	cache: bool = field( default=False ) # turn off by default, at least for now
+	index: bool = field( default=False ) # keep a local index of albums, folders and items
+	index_max_age: int = field( default=int( INDEX_MAX_AGE.total_seconds() ) ) # seconds after which indexed data is fetched again
 
 	profile: str = field( default=None )
 	profiles: Dict[str, Profile] = field( factory=dict )
@@ -87,58 +135,85 @@ class ApplicationContext:
 
 	debug: bool = field( default=False )
 	force: bool = field( default=False )
+	stats: bool = field( default=False )
 	verbose: bool = field( default=False )
 
 	service: WebService = field( default=None )
+	index: Optional['MetadataIndex'] = field( default=None )
 
 	def __attrs_post_init__( self ):
 		self.__configure_log__()
 		self.__load_config_files()
 
 	def __configure_log__( self ):
-		global DEFAULT_HANDLER, VERBOSE_HANDLER, DEBUG_HANDLER
-		if self.debug:
-			DEBUG_HANDLER.setLevel( DEBUG )
-			VERBOSE_HANDLER.setLevel( DISABLE )
-			DEFAULT_HANDLER.setLevel( DISABLE )
-			log.setLevel( DEBUG )
-		elif self.verbose:
-			DEBUG_HANDLER.setLevel( DISABLE )
-			VERBOSE_HANDLER.setLevel( INFO )
-			DEFAULT_HANDLER.setLevel( DISABLE )
-			log.setLevel( INFO )
-		else:
-			DEBUG_HANDLER.setLevel( DISABLE )
-			VERBOSE_HANDLER.setLevel( DISABLE )
-			DEFAULT_HANDLER.setLevel( WARNING )
-			log.setLevel( WARNING )
+		global LOG_HANDLER
+		if LOG_HANDLER:
+			log.removeHandler( LOG_HANDLER )
+		LOG_HANDLER = DeferredHandler( self.debug, self.verbose )
+		log.addHandler( LOG_HANDLER )
+		log.setLevel( DEBUG if self.debug else INFO if self.verbose else WARNING )
 
 	def __load_config_files( self ):
 		self.config = self.__load_file( CONFIG_FILE, Config, exit_on_fail=False )
-		# self.sessions = self.__load_file( SESSIONS_FILE, Dict[str, SynoSession], False )
+		self.sessions = self.__load_sessions()
+
+		# the journal is always kept as it records change tokens of synced items, config.cache only enables filesize comparisons
+		makedirs( cfg_path( '' ), exist_ok=True )
+		migrate = not exists( cfg_path( CACHE_JOURNAL_FILE ) ) and exists( cfg_path( CACHE_FILE ) )
+		self.cache = Cache( path=cfg_path( CACHE_JOURNAL_FILE ) )
+		if migrate:
+			self.__migrate_cache()
 
+	def __migrate_cache( self ):
+		self.cache.migrate( load_legacy_cache( _read_text( CACHE_FILE ) ) )
+		replace( cfg_path( CACHE_FILE ), cfg_path( f'{CACHE_FILE}.bak' ) )
+		log.info( f'migrated {len( self.cache.filesizes )} filesize entries from {CACHE_FILE} to {CACHE_JOURNAL_FILE}' )
+
+	# noinspection PyMethodMayBeStatic
+	def __load_sessions( self ) -> Dict[str, SynoSession]:
+		# sessions are only reused to save the login, so an unreadable file is not an error
 		try:
-			if self.config.cache:
-				self.cache = load_cache( CFG_FS.readtext( CACHE_FILE, 'UTF-8' ) )
-		except ResourceNotFound:
-			log.debug( f'unable to read cache file', exc_info=True )
+			sessions = safe_load( _read_text( SESSIONS_FILE ) ) or {}
+			# drop empty values, as the converter would turn them into 'None' strings
+			return { profile: CONVERTER.structure( { k: v for k, v in s.items() if v is not None }, SynoSession ) for profile, s in sessions.items() }
+		except FileNotFoundError:
+			return {}
+		except Exception:
+			log.debug( f'unable to read file {SESSIONS_FILE}, ignoring saved sessions', exc_info=True )
+			return {}
 
 	# noinspection PyMethodMayBeStatic
 	def __load_file( self, filename: str, cls: Type[T] = None, exit_on_fail: bool = True ) -> Optional[T]:
 		try:
-			return CONVERTER.loads( CFG_FS.readtext( filename ), cls )
-		except ResourceNotFound:
+			return CONVERTER.loads( _read_text( filename ), cls )
+		except FileNotFoundError:
 			log.debug( f'unable to read file {filename}', exc_info=True )
 			if exit_on_fail:
 				sysexit( -1 )
 			return cls()
 
+	def open_index( self, refresh: bool = False ) -> 'MetadataIndex':
+		from synophotos.index import MetadataIndex
+		path = cfg_path( INDEX_FILE.format( profile=self.config.profile ) )
+		self.index = MetadataIndex( path=path, max_age=timedelta( seconds=self.config.index_max_age ), refresh=refresh )
+		return self.index
+
 	def save_config_files( self ):
-			try:
-				if self.config.cache:
-					CFG_FS.writetext( CACHE_FILE, dump_cache( self.cache ), 'UTF-8' )
-			except ResourceNotFound:
-				log.error( f'unable to write file {CACHE_FILE}', exc_info=True )
+		self.cache.close()
+
+	def save_session( self, session: Optional[SynoSession] ) -> None:
+		# a dropped (None) session is removed, so that it is not reused by the next run
+		if session:
+			self.sessions[self.config.profile] = session
+		else:
+			self.sessions.pop( self.config.profile, None )
+		# session ids grant access to the account, so the file is created readable for the owner only and moved into place
+		tmp = cfg_path( f'{SESSIONS_FILE}.tmp' )
+		with fdopen( os_open( tmp, O_WRONLY | O_CREAT | O_TRUNC, 0o600 ), 'w', encoding='UTF-8' ) as f:
+			f.write( safe_dump( { profile: asdict( s ) for profile, s in self.sessions.items() } ) )
+		chmod( tmp, 0o600 ) # in case the temporary file has been left over by an earlier run with other permissions
+		replace( tmp, cfg_path( SESSIONS_FILE ) )
+		log.debug( f'saved session with SID = {session.sid} for profile {self.config.profile}' if session else f'removed session of profile {self.config.profile}' )
 
 	@property
 	def url( self ) -> str:
@@ -153,10 +228,31 @@ class ApplicationContext:
 		return self.config.active_profile.password
 
 	@property
-	def session( self ) -> SynoSession:
-		return self.sessions.get( self.config.profile )
+	def pool_size( self ) -> int:
+		return self.config.active_profile.pool_size
+
+	@property
+	def concurrency( self ) -> int:
+		return self.config.active_profile.concurrency
+
+	def limiter( self ) -> AdaptiveLimiter:
+		profile = self.config.active_profile
+		if not profile.adaptive:
+			return AdaptiveLimiter( min_limit=profile.max_requests, max_limit=profile.max_requests )
+		return AdaptiveLimiter( min_limit=profile.min_requests, max_limit=profile.max_requests, limit=min( profile.concurrency, profile.max_requests ) )
+
+	@property
+	def session( self ) -> Optional[SynoSession]:
+		# a saved session is only reused when it belongs to the account of the active profile
+		session = self.sessions.get( self.config.profile )
+		return session if session and session.account in [ None, self.account ] else None
 
 def teardown():
 	ctx = get_current_context().obj
 	ctx.save_config_files()
-
+	if ctx.service:
+		ctx.service.transport.close()
+		if ctx.stats:
+			print_stats( ctx.service.stats.summary() )
+	if ctx.index:
+		ctx.index.close()
@@ -0,0 +1,365 @@
+# asyncio counterparts of SynoWebService and SynoPhotos, requires aiohttp (pip install synophotos[async])
+
+from __future__ import annotations
+
+from asyncio import Semaphore, gather
+from datetime import datetime
+from logging import getLogger
+from time import perf_counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from attrs import define, field
+from more_itertools import first
+
+try:
+	from aiohttp import ClientResponseError, ClientSession, TCPConnector
+except ImportError as e:
+	raise ImportError( 'synophotos.aio requires aiohttp, install it via "pip install synophotos[async]"' ) from e
+
+from synophotos.exif import SynoExif
+from synophotos.parameters.photos import *
+from synophotos.parameters.webservice import ENTRY_URL, LOGIN_PARAMS
+from synophotos.photos import Album, AlbumCatalog, Folder, Item, Member, Permission, ThumbnailSize
+from synophotos.stats import RequestStats
+from synophotos.webservice import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE, SynoResponse, SynoSession, conv, json_loads
+
+log = getLogger( __name__ )
+
+T = TypeVar( 'T' )
+R = TypeVar( 'R' )
+
+@define
+class AsyncSynoResponse( SynoResponse ):
+	# the body is read before creating the response, there is no underlying requests response to consume or close
+
+	content: Optional[bytes] = field( default=None )
+
+	def __attrs_post_init__( self ):
+		if self.payload is not None:
+			self.parse( self.payload )
+		else:
+			self.success = True if self.status_code in range( 200, 300 ) else False
+
+	def as_bytes( self ) -> bytes:
+		return self.content
+
+	def iter_bytes( self, chunk_size: int = DEFAULT_CHUNK_SIZE ) -> Iterator[bytes]:
+		content = self.content or b''
+		for offset in range( 0, len( content ), chunk_size ):
+			yield content[offset:offset + chunk_size]
+
+	def close( self ) -> None:
+		self._release()
+
+	def request( self ) -> None:
+		return None
+
+	def as_text( self ) -> str:
+		return self.content.decode( 'UTF-8' ) if self.content is not None else ''
+
+	def is_json( self ) -> bool:
+		return self.payload is not None
+
+@define
+class AsyncSynoWebService:
+
+	url: str = field( default=None )
+	account: str = field( default=None )
+	password: str = field( default=None )
+
+	session: SynoSession = field( default=None )
+
+	pool_size: int = field( default=DEFAULT_POOL_SIZE )
+	concurrency: int = field( default=DEFAULT_CONCURRENCY )
+	stats: RequestStats = field( factory=RequestStats )
+
+	_http: Optional[ClientSession] = field( init=False, default=None )
+	_semaphore: Optional[Semaphore] = field( init=False, default=None )
+
+	async def __aenter__( self ) -> AsyncSynoWebService:
+		return self
+
+	async def __aexit__( self, *args ) -> None:
+		await self.close()
+
+	@property
+	def http( self ) -> ClientSession:
+		# the client session needs to be created from within a running event loop
+		if self._http is None:
+			self._http = ClientSession( connector=TCPConnector( limit=self.pool_size ) )
+		return self._http
+
+	@property
+	def session_id( self ) -> Optional[str]:
+		return self.session.sid if self.session else None
+
+	async def close( self ) -> None:
+		if self._http is not None:
+			await self._http.close()
+			self._http = None
+
+	def get_url( self, stub: str ) -> str:
+		return stub.format( url=self.url )
+
+	async def entry( self, payload: Dict, **kwargs ) -> AsyncSynoResponse:
+		return await self.get( ENTRY_URL, payload, **kwargs )
+
+	async def get( self, url: str, template: Dict, **kwargs ) -> AsyncSynoResponse:
+		return await self.req( 'GET', url, template, **kwargs )
+
+	async def post( self, url: str, template: Dict, **kwargs ) -> AsyncSynoResponse:
+		return await self.req( 'POST', url, template, **kwargs )
+
+	async def req( self, method: str, url: str, template: Dict, **kwargs ) -> AsyncSynoResponse:
+		url = self.get_url( url )
+		if self.session_id:
+			template = template | SID | { '_sid': self.session_id }
+
+		params = template | kwargs
+		params = { k: str( v ) for k, v in params.items() if v is not None } # aiohttp only accepts str, int and float
+
+		log.debug( f'[dark_orange]{method}[/dark_orange] {url}' )
+
+		# parameters of post requests are sent as form body, like the synchronous transport does
+		body = { 'data': params } if method == 'POST' else { 'params': params }
+		start = perf_counter()
+		try:
+			async with self.http.request( method, url, **body ) as response:
+				raw = await response.read()
+				if 'json' in response.headers.get( 'Content-Type', '' ):
+					payload, content = json_loads( raw ), None
+				else:
+					payload, content = None, raw
+		except Exception as e:
+			self.stats.record( params.get( 'api' ), params.get( 'method' ), perf_counter() - start, error_code=type( e ).__name__ )
+			raise
+
+		log.debug( f'[dark_orange]Response:[/dark_orange] {response.status}' )
+
+		syno_response = AsyncSynoResponse( status_code=response.status, payload=payload, content=content )
+		bytes_out = len( str( response.url ) ) + ( sum( len( k ) + len( v ) + 2 for k, v in params.items() ) if method == 'POST' else 0 )
+		error_code = None if syno_response.success else ( syno_response.error_code or response.status )
+		self.stats.record( params.get( 'api' ), params.get( 'method' ), perf_counter() - start, bytes_out=bytes_out, bytes_in=len( raw ), error_code=error_code )
+		return syno_response
+
+	async def iter_req( self, url: str, template: Dict, chunk_size: int = DEFAULT_CHUNK_SIZE, **kwargs ) -> AsyncIterator[bytes]:
+		params = template | ( SID | { '_sid': self.session_id } if self.session_id else {} ) | kwargs
+		params = { k: str( v ) for k, v in params.items() if v is not None }
+		start, response, bytes_in, error_code = perf_counter(), None, 0, None
+		try:
+			async with self.http.get( self.get_url( url ), params=params ) as response:
+				response.raise_for_status()
+				async for chunk in response.content.iter_chunked( chunk_size ):
+					bytes_in += len( chunk )
+					yield chunk
+		except ClientResponseError as e:
+			error_code = e.status
+			raise
+		except Exception as e:
+			error_code = type( e ).__name__
+			raise
+		finally:
+			# latency covers the whole transfer, as the content is consumed while iterating
+			self.stats.record( params.get( 'api' ), params.get( 'method' ), perf_counter() - start, bytes_out=len( str( response.url ) ) if response else 0, bytes_in=bytes_in, error_code=error_code )
+
+	async def gather( self, fn: Callable[[T], Awaitable[R]], elements: List[T] ) -> List[R]:
+		# results are returned in the order of elements
+		if self._semaphore is None:
+			self._semaphore = Semaphore( self.concurrency )
+
+		async def bounded( e: T ) -> R:
+			async with self._semaphore:
+				return await fn( e )
+
+		return list( await gather( *[ bounded( e ) for e in elements ] ) )
+
+	async def login( self, otp_code: str = None ) -> SynoSession:
+		if self.session and self.session.is_valid():
+			return self.session
+
+		response = await self.get( ENTRY_URL, LOGIN_PARAMS, account=self.account, passwd=self.password, otp_code=otp_code )
+		if response.success:
+			self.session = conv.structure_attrs_fromdict( {**response.data, 'updated_at': datetime.utcnow().isoformat()}, SynoSession )
+		else:
+			self.session = conv.structure_attrs_fromdict( {'error_code': response.error_code, 'error_msg': response.error_msg}, SynoSession )
+		return self.session
+
+@define
+class AsyncSynoPhotos( AsyncSynoWebService ):
+
+	catalog: AlbumCatalog = field( factory=AlbumCatalog )
+
+	# counting elements
+
+	async def count_albums( self ) -> int:
+		return ( await self.entry( COUNT_ALBUM ) ).data.get( 'count' )
+
+	async def count_folders( self, parent_id: int = 0 ) -> int:
+		return ( await self.entry( {**COUNT_FOLDER, 'id': parent_id} ) ).data.get( 'count' )
+
+	async def count_items( self, folder_id: int = None, album_id: int = None ) -> int:
+		if folder_id:
+			return ( await self.entry( {**COUNT_ITEM, 'folder_id': folder_id} ) ).data.get( 'count' )
+		elif album_id:
+			return ( await self.entry( {**COUNT_ITEM, 'album_id': album_id} ) ).data.get( 'count' )
+		else:
+			return ( await self.entry( COUNT_ITEM ) ).data.get( 'count' )
+
+	# listing elements
+
+	async def list_albums( self, *names: str, include_shared: bool = False ) -> List[Album]:
+		albums = ( await self.entry( BROWSE_ALBUM if not include_shared else BROWSE_ALBUM_ALL ) ).as_list( Album )
+		if include_shared:
+			self.catalog.update( albums )
+		if names:
+			albums = list( filter( lambda a: any( n for n in names if n.lower() in a.name.lower() ), albums ) )
+		return sorted( albums, key=lambda a: a.name )
+
+	async def list_folders( self, parent_id: int = None, name: str = None, recursive: bool = False ) -> List[Folder]:
+		if parent_id in [None, 0]:
+			parent_id = ( await self.root_folder() ).id
+
+		folders, level = [], [parent_id]
+		while level:
+			pages = await self.gather( lambda pid: self.entry( {**BROWSE_FOLDER, 'id': pid} ), level )
+			children = [ f for page in pages for f in page.as_list( Folder ) ]
+			folders.extend( children )
+			level = [ c.id for c in children ] if recursive else []
+
+		if name:
+			folders = filter( lambda f: name.lower() in f.name.lower(), folders )
+
+		return sorted( folders, key=lambda f: f.folder_name )
+
+	async def list_album_items( self, album_id: int = None ) -> List[Item]:
+		if not album_id:
+			return []
+
+		album = await self.catalog_album( album_id )
+		if album.shared and album.passphrase:
+			payload, count = {**LIST_SHARED_ITEMS, 'passphrase': f'"{album.passphrase}"'}, album.item_count
+		else:
+			payload, count = {**BROWSE_ITEM, 'album_id': album_id}, await self.count_items( album_id=album_id )
+
+		return ( await self._list_pages( [ ( payload, count ) ] ) )[0]
+
+	async def list_folder_items( self, folder_id: int = None, recursive: bool = False ) -> List[Item]:
+		parent_ids = [folder_id]
+		if recursive:
+			parent_ids.extend( [ f.id for f in await self.list_folders( folder_id, recursive=True ) ] )
+
+		counts = await self.gather( lambda fid: self.count_items( folder_id=fid ), parent_ids )
+		pages = await self._list_pages( [ ( {**BROWSE_ITEM, 'folder_id': fid}, count ) for fid, count in zip( parent_ids, counts ) ] )
+		return [ i for page in pages for i in page ]
+
+	async def list_items( self, album_id: int = None, folder_id: int = None, recursive: bool = False, name: str = None ) -> List[Item]:
+		if not album_id and not folder_id:
+			folder_id = ( await self.root_folder() ).id
+
+		if album_id:
+			items = await self.list_album_items( album_id )
+		else:
+			items = await self.list_folder_items( folder_id, recursive )
+
+		return list( filter( lambda i: name.lower() in i.filename.lower(), items ) ) if name else items
+
+	async def _list_pages( self, listings: List[Tuple[Dict, int]] ) -> List[List[Item]]:
+		# same approach as SynoPhotos._list_pages(): fetch all counted pages concurrently, continue sequentially when the last page is full
+		pages = [ ( index, payload, offset ) for index, ( payload, count ) in enumerate( listings ) for offset in range( payload.get( 'offset' ), count or 0, payload.get( 'limit' ) ) ]
+		fetched = await self.gather( lambda p: self.entry( {**p[1], 'offset': p[2]} ), pages )
+
+		results = [ [] for _ in listings ]
+		next_offsets = [ payload.get( 'offset' ) for payload, count in listings ]
+		full = [ True for _ in listings ]
+		for ( index, payload, offset ), response in zip( pages, fetched ):
+			page = response.as_list( Item )
+			results[index].extend( page )
+			next_offsets[index], full[index] = offset + payload.get( 'limit' ), len( page ) == payload.get( 'limit' )
+
+		for index, ( payload, count ) in enumerate( listings ):
+			offset, limit = next_offsets[index], payload.get( 'limit' )
+			while full[index]:
+				page = ( await self.entry( {**payload, 'offset': offset} ) ).as_list( Item )
+				results[index].extend( page )
+				offset, full[index] = offset + limit, len( page ) == limit
+
+		return results
+
+	# single elements
+
+	async def catalog_album( self, id: int ) -> Optional[Album]:
+		if self.catalog.is_expired() or id not in self.catalog.albums:
+			await self.list_albums( include_shared=True )
+		return self.catalog.albums.get( id )
+
+	async def album( self, id: int ) -> Optional[Album]:
+		album = first( ( await self.entry( GET_ALBUM, id=f'[{id}]' ) ).as_obj( List[Album] ), None )
+		if not album and ( album := await self.catalog_album( id ) ):
+			album = first( ( await self.entry( GET_SHARED_ALBUM, passphrase=album.passphrase ) ).as_obj( List[Album] ) )
+		return album
+
+	async def folder( self, id: int ) -> Folder:
+		return ( await self.entry( GET_FOLDER, id=id ) ).as_obj( Folder )
+
+	async def root_folder( self ) -> Folder:
+		return await self.folder( 0 )
+
+	async def item( self, id: int, passphrase: str = None ) -> Optional[Item]:
+		if passphrase:
+			return first( ( await self.entry( GET_SHARED_ITEM, id=f'[{id}]', passphrase=passphrase ) ).as_obj( List[Item] ), None )
+		else:
+			return first( ( await self.entry( GET_ITEM, id=f'[{id}]' ) ).as_obj( List[Item] ), None )
+
+	async def exif( self, item_id: int ) -> SynoExif:
+		return SynoExif( response=await self.entry( GET_EXIF, id=f'[{item_id}]' ) )
+
+	# downloading
+
+	async def download( self, item_id: int, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, include_exif = False ) -> Tuple[Item, bytes]:
+		item = await self.item( item_id, passphrase )
+		payload, params = self._download_params( item, passphrase, thumbnail )
+		binary = ( await self.entry( payload, **params ) ).as_bytes()
+
+		if include_exif:
+			binary = ( await self.exif( item_id ) ).apply( binary, item )
+
+		return item, binary
+
+	async def iter_download( self, item: Item, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, chunk_size: int = DEFAULT_CHUNK_SIZE ) -> AsyncIterator[bytes]:
+		payload, params = self._download_params( item, passphrase, thumbnail )
+		async for chunk in self.iter_req( ENTRY_URL, payload, chunk_size, **params ):
+			yield chunk
+
+	# noinspection PyMethodMayBeStatic
+	def _download_params( self, item: Item, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None ) -> Tuple[Dict, Dict[str, Any]]:
+		if thumbnail in ['sm', 'm', 'xl']:
+			return DOWNLOAD_THUMBNAIL, { 'id': item.id, 'cache_key': item.additional.thumbnail.get( 'cache_key' ), 'passphrase': passphrase }
+		elif thumbnail == 'compressed':
+			return DOWNLOAD_COMPRESSED, { 'item_id': f'[{item.id}]', 'passphrase': passphrase }
+		else:
+			return DOWNLOAD_ORIGINAL, { 'item_id': f'[{item.id}]', 'passphrase': passphrase }
+
+	# sharing
+
+	async def share_album( self, album_id: int, role: str, public: bool, user_id: int, group_id: int ) -> Optional[SynoResponse]:
+		if not public and not user_id and not group_id:
+			return
+
+		response = await self.entry( SHARE_ALBUM, album_id=album_id, enabled='true' )
+		self.catalog.invalidate()
+
+		if public:
+			permissions = [Permission( role=role, member=Member( type='public' ) )]
+		elif user_id:
+			permissions = [Permission( role=role, member=Member( type='user', id=user_id ) )]
+		else:
+			permissions = [Permission( role=role, member=Member( type='group', id=group_id ) )]
+
+		return await self.grant_permission( permissions, response.data.get( 'passphrase' ) )
+
+	async def grant_permission( self, permissions: List[Permission], passphrase: str ) -> SynoResponse:
+		return await self.entry( UPDATE_PERMISSION, permission=Permission.as_str( permissions ), passphrase=f'"{passphrase}"' )
+
+	async def unshare_album( self, album_id: int ) -> SynoResponse:
+		self.catalog.invalidate()
+		return await self.entry( SHARE_ALBUM, album_id=album_id, enabled='false' )
@@ -1,27 +1,172 @@
-from typing import Dict
+from logging import getLogger
+from os import replace
+from os.path import exists
+from struct import Struct
+from threading import RLock
+from typing import BinaryIO, Dict, Optional
 
 from attrs import define, field
-from cattrs.gen import make_dict_unstructure_fn, override
-from cattrs.preconf.pyyaml import make_converter
+from yaml import safe_load
+
+log = getLogger( __name__ )
+
+# journal format: a sequence of records, each consisting of a header (kind, item id, length of value) followed by the value
+# later records overwrite earlier records of the same kind and item id
+
+HEADER = Struct( '<BqI' )
+INT_VALUE = Struct( '<q' )
+
+KIND_FILESIZE = 1
+KIND_TOKEN = 2 # change token of an item, utf-8 encoded
+KIND_LOCAL_SIZE = 3 # size of the file written for an item, which differs from the filesize of the item for thumbnails
+
+COMPACTION_THRESHOLD = 10000 # minimum number of obsolete records before the journal is compacted
 
 @define
 class Cache:
 
 	enabled: bool = field( default=False )
+	path: Optional[str] = field( default=None ) # path of the journal, when None the cache is kept in memory only
+
+	_filesizes: Optional[Dict[int, int]] = field( init=False, default=None )
+	_tokens: Optional[Dict[int, str]] = field( init=False, default=None )
+	_local_sizes: Optional[Dict[int, int]] = field( init=False, default=None )
+	_journal: Optional[BinaryIO] = field( init=False, default=None )
+	_records: int = field( init=False, default=0 )
+	_lock: RLock = field( init=False, factory=RLock )
+
+	@property
+	def filesizes( self ) -> Dict[int, int]:
+		if self._filesizes is None:
+			self.load()
+		return self._filesizes
 
-	filesizes: Dict[int, int] = field( factory=dict )
+	@property
+	def tokens( self ) -> Dict[int, str]:
+		if self._tokens is None:
+			self.load()
+		return self._tokens
 
 	def cmp_filesize( self, item_id: int, filesize: int ) -> bool:
 		return filesize == self.filesizes.get( item_id ) if self.enabled else False
 
-# structuring/unstructuring
+	def set_filesize( self, item_id: int, filesize: int ) -> None:
+		with self._lock:
+			if self.filesizes.get( item_id ) != filesize:
+				self.filesizes[item_id] = filesize
+				self._append( KIND_FILESIZE, item_id, INT_VALUE.pack( filesize ) )
+
+	def get_token( self, item_id: int ) -> Optional[str]:
+		return self.tokens.get( item_id )
+
+	def set_token( self, item_id: int, token: str ) -> None:
+		with self._lock:
+			if self.tokens.get( item_id ) != token:
+				self.tokens[item_id] = token
+				self._append( KIND_TOKEN, item_id, token.encode( 'utf-8' ) )
+
+	@property
+	def local_sizes( self ) -> Dict[int, int]:
+		if self._local_sizes is None:
+			self.load()
+		return self._local_sizes
+
+	def get_local_size( self, item_id: int ) -> Optional[int]:
+		return self.local_sizes.get( item_id )
+
+	def set_local_size( self, item_id: int, size: int ) -> None:
+		with self._lock:
+			if self.local_sizes.get( item_id ) != size:
+				self.local_sizes[item_id] = size
+				self._append( KIND_LOCAL_SIZE, item_id, INT_VALUE.pack( size ) )
+
+	# journal handling
+
+	def load( self ) -> None:
+		with self._lock:
+			self._filesizes, self._tokens, self._local_sizes, self._records = {}, {}, {}, 0
+			if not self.path or not exists( self.path ):
+				return
+
+			with open( self.path, 'rb' ) as f:
+				data = f.read()
+
+			offset = 0
+			while offset + HEADER.size <= len( data ):
+				kind, item_id, length = HEADER.unpack_from( data, offset )
+				if offset + HEADER.size + length > len( data ):
+					break
+				value = data[offset + HEADER.size:offset + HEADER.size + length]
+				if kind == KIND_FILESIZE:
+					self._filesizes[item_id] = INT_VALUE.unpack( value )[0]
+				elif kind == KIND_TOKEN:
+					self._tokens[item_id] = value.decode( 'utf-8' )
+				elif kind == KIND_LOCAL_SIZE:
+					self._local_sizes[item_id] = INT_VALUE.unpack( value )[0]
+				offset, self._records = offset + HEADER.size + length, self._records + 1
+
+			# cut off incomplete records, which might be left after an interrupted write
+			if offset < len( data ):
+				log.warning( f'discarding {len( data ) - offset} bytes of incomplete records in cache journal {self.path}' )
+				with open( self.path, 'r+b' ) as f:
+					f.truncate( offset )
+
+			log.debug( f'loaded {len( self._filesizes )} filesize, {len( self._tokens )} token and {len( self._local_sizes )} local size entries from {self._records} records in {self.path}' )
+
+	def compact( self ) -> None:
+		with self._lock:
+			if not self.path:
+				return
+
+			self._close_journal()
+			with open( f'{self.path}.tmp', 'wb' ) as f:
+				for item_id, filesize in self.filesizes.items():
+					f.write( HEADER.pack( KIND_FILESIZE, item_id, INT_VALUE.size ) + INT_VALUE.pack( filesize ) )
+				for item_id, token in self.tokens.items():
+					value = token.encode( 'utf-8' )
+					f.write( HEADER.pack( KIND_TOKEN, item_id, len( value ) ) + value )
+				for item_id, size in self.local_sizes.items():
+					f.write( HEADER.pack( KIND_LOCAL_SIZE, item_id, INT_VALUE.size ) + INT_VALUE.pack( size ) )
+			replace( f'{self.path}.tmp', self.path )
+			self._records = self._entries()
+			log.debug( f'compacted cache journal {self.path} to {self._records} records' )
+
+	def close( self ) -> None:
+		with self._lock:
+			if self._filesizes is not None and self._obsolete_records() > min( COMPACTION_THRESHOLD, self._entries() ):
+				self.compact()
+			self._close_journal()
+
+	def migrate( self, filesizes: Dict[int, int] ) -> None:
+		with self._lock:
+			self._filesizes = { **self.filesizes, **filesizes }
+			self.compact()
+
+	def _append( self, kind: int, item_id: int, value: bytes ) -> None:
+		if not self.path:
+			return
+		if self._journal is None:
+			self._journal = open( self.path, 'ab' )
+		# flush immediately, so that recorded entries survive an interrupted run
+		self._journal.write( HEADER.pack( kind, item_id, len( value ) ) + value )
+		self._journal.flush()
+		self._records += 1
+
+		if self._obsolete_records() > max( COMPACTION_THRESHOLD, self._entries() ):
+			self.compact()
+
+	def _entries( self ) -> int:
+		return len( self._filesizes ) + len( self._tokens ) + len( self._local_sizes ) if self._filesizes is not None else 0
+
+	def _obsolete_records( self ) -> int:
+		return self._records - self._entries() if self._filesizes is not None else 0
 
-conv = make_converter()
-hook = make_dict_unstructure_fn( Cache, conv, enabled=override( omit=True ) )
-conv.register_unstructure_hook( Cache, hook )
+	def _close_journal( self ) -> None:
+		if self._journal is not None:
+			self._journal.close()
+			self._journal = None
 
-def dumps( cache: Cache ) -> str:
-	return conv.dumps( cache )
+# reading the legacy yaml cache file
 
-def loads( data: str ) -> Cache:
-	return conv.loads( data, Cache )
+def loads( data: str ) -> Dict[int, int]:
+	return { int( k ): int( v ) for k, v in ( ( safe_load( data ) or {} ).get( 'filesizes' ) or {} ).items() }
@@ -1,15 +1,18 @@
+from __future__ import annotations
+
 from logging import getLogger
 from sys import exit as sysexit
-from typing import Optional, Tuple, cast
+from typing import TYPE_CHECKING, Optional, Tuple, cast
 
 from click import Context, argument, group, option, pass_context, pass_obj
-from fs.osfs import OSFS
 from yaml import safe_dump
 
 from synophotos import ApplicationContext, __version__, teardown
-from synophotos.fsio import prepare_sync_albums, remove_item, write_item
-from synophotos.photos import SynoPhotos, ThumbnailSize
-from synophotos.ui import confirm, pprint, pprint as pp, print_error, print_obj, print_obj_table, table_for
+from synophotos.ui import confirm, pprint, pprint as pp, print_error, print_iter, print_obj, print_obj_table, progress_bar, table_for
+
+# modules talking to the server or writing files are imported by the commands using them, so that startup stays fast
+if TYPE_CHECKING:
+	from synophotos.photos import SynoPhotos, ThumbnailSize
 
 log = getLogger( __name__ )
 
@@ -20,28 +23,32 @@ no_login_commands = [ 'init', 'profile', 'version' ]
 @group
 @option( '-d', '--debug', is_flag=True, required=False, default=False, help='outputs debug information (implies --verbose)' )
 @option( '-f', '--force', is_flag=True, required=False, default=False, help='forces the execution of commands and skips confirmation dialogs' )
+@option( '--refresh', is_flag=True, required=False, default=False, help='refreshes the local index from the server (only if the index is enabled)' )
+@option( '--stats', is_flag=True, required=False, default=False, help='prints statistics of all requests sent to the server' )
 @option( '-v', '--verbose', is_flag=True, required=False, default=False, help='outputs verbose log information' )
 @pass_context
-def cli( ctx: Context, debug: bool, force: bool, verbose: bool ):
-	ctx.obj = ApplicationContext( verbose=verbose, debug=debug, force=force )
+def cli( ctx: Context, debug: bool, force: bool, refresh: bool, stats: bool, verbose: bool ):
+	ctx.obj = ApplicationContext( verbose=verbose, debug=debug, force=force, stats=stats )
 
 	ctx.call_on_close( teardown )
 
-	if ctx.obj.config.active_profile:
+	if ctx.obj.config.active_profile and ctx.invoked_subcommand not in no_login_commands:
 		# create (global) service (to ease login) and add to context
+		from synophotos.photos import SynoPhotos
 		global synophotos
-		synophotos = SynoPhotos( url=ctx.obj.url, account=ctx.obj.account, password=ctx.obj.password, session=ctx.obj.session )
+		synophotos = SynoPhotos( url=ctx.obj.url, account=ctx.obj.account, password=ctx.obj.password, session=ctx.obj.session, pool_size=ctx.obj.pool_size, concurrency=ctx.obj.concurrency, limiter=ctx.obj.limiter(), on_session=ctx.obj.save_session )
 		if ctx.obj.config.cache:
 			synophotos.enable_cache( ctx.obj.cache )
+		if ctx.obj.config.index:
+			synophotos.index = ctx.obj.open_index( refresh )
 
 		ctx.obj.service = synophotos
 
 		# attempt to log in
-		if not ctx.invoked_subcommand in no_login_commands:
-			if not synophotos.login( ctx.obj ):
-				#ctx.obj.console.print( f'error logging in code={syno_session.error_code}, msg={syno_session.error_msg}' )
-				print_error( 'failed to log in' )
-				sysexit( -1 )
+		if not synophotos.login( ctx.obj ):
+			#ctx.obj.console.print( f'error logging in code={syno_session.error_code}, msg={syno_session.error_msg}' )
+			print_error( 'failed to log in' )
+			sysexit( -1 )
 
 @cli.command( help='initializes the application' )
 @pass_obj
@@ -74,15 +81,18 @@ def create( ctx: ApplicationContext,  name: str, folder: str, folder_id: int, sh
 			return
 
 	elif folder_id:
-		folder = synophotos.folder( int( folder ) )
+		folder = synophotos.folder( folder_id )
 
 	album = synophotos.create_album( name )
 	log.info( f'created album [dark_orange]{album.name}[/dark_orange] with id {album.id}' )
 
 	if folder:
-		items = synophotos.list_items( folder.id, recursive=False )
-		synophotos.add_album_items( album, items )
-		log.info( f'added {len( items )} from [dark_orange]{folder.name}[/dark_orange] to album [dark_orange]{album.name}[/dark_orange]' )
+		with progress_bar() as progress:
+			task = progress.add_task( f'adding items from {folder.name}', total=synophotos.count_items( folder_id=folder.id ) )
+			result = synophotos.populate_album( album, synophotos.iter_folder_items( folder.id ), progress=lambda count: progress.advance( task, count ) )
+		log.info( f'added {len( result.added )} items from [dark_orange]{folder.name}[/dark_orange] to album [dark_orange]{album.name}[/dark_orange]' )
+		if result.failures:
+			print_error( f'failed to add {result.lengths()[2]} items to album {album.name}, run the command again to retry' )
 
 	if share:
 		raise NotImplementedError
@@ -125,7 +135,8 @@ def albums( ctx: ApplicationContext, names: Tuple[str], shared: bool ):
 @argument( 'name', nargs=1, required=False, type=str )
 @pass_obj
 def folders( ctx: ApplicationContext, name: str, parent_id: int, recursive: bool ):
-		print_obj( synophotos.list_folders( parent_id, name, recursive ) )
+		from synophotos.photos import Folder
+		print_iter( synophotos.iter_folders( parent_id, name, recursive ), Folder )
 
 @cli.command( help='lists items' )
 @option( '-a', '--album', required=False, default=None, help='id of the parent album', type=int )
@@ -134,17 +145,12 @@ def folders( ctx: ApplicationContext, name: str, parent_id: int, recursive: bool
 @argument( 'name', nargs=1, required=False, type=str )
 @pass_obj
 def items( ctx: ApplicationContext, album: int, folder: int, recursive: bool, name: str = None ):
-	if recursive:
-		pp( '[red]fetching items without paging and/or recursively, this might take a while ...[/red]' )
-
 	if album and folder:
 		print_error( '-a and -f cannot be used together, specify only one option' )
 		return
 
-	if not album and not folder:
-		folder = synophotos.root_folder()
-
-	print_obj( synophotos.list_items( album_id=album, folder_id=folder, recursive=recursive, name=name ) )
+	from synophotos.photos import Item
+	print_iter( synophotos.iter_items( album_id=album, folder_id=folder, recursive=recursive, name=name ), Item )
 
 @cli.command( help='lists existing groups and their ids' )
 @pass_obj
@@ -232,13 +238,24 @@ def search( ctx: ApplicationContext, name: str ):
 @argument( 'id', nargs=1, required=True )
 @pass_obj
 def download( ctx: ApplicationContext, destination: str, id: int, size: ThumbnailSize, exif: bool ):
-	item, contents = synophotos.download( id, thumbnail=size, include_exif=exif )
-	folder = synophotos.folder( item.folder_id )
+	from fs.osfs import OSFS
+	from synophotos.fsio import write_resumable
 
 	fs = OSFS( root_path=destination, expand_vars=True, create=True )
-	fs.makedirs( folder.name, recreate=True )
-	fs.writebytes( path=f'{folder.name}/{item.filename}', contents=contents )
-	log.info( f'downloaded item {item.id} to: {folder.name}/{item.filename}, wrote {len( contents )} bytes' )
+
+	if exif: # applying exif data requires the full content
+		item, contents = synophotos.download( id, thumbnail=size, include_exif=exif )
+		folder = synophotos.folder( item.folder_id )
+		fs.makedirs( folder.name, recreate=True )
+		fs.writebytes( path=f'{folder.name}/{item.filename}', contents=contents )
+		written = len( contents )
+	else:
+		item = synophotos.item( id )
+		folder = synophotos.folder( item.folder_id )
+		expected_size = item.filesize if size in [None, 'original'] else None
+		written = write_resumable( lambda offset: synophotos.stream( item, thumbnail=size, offset=offset ), fs, f'{folder.name}/{item.filename}', item.id, expected_size )
+
+	log.info( f'downloaded item {item.id} to: {folder.name}/{item.filename}, wrote {written} bytes' )
 
 @cli.command( help='displays information on items, folder and albums (this is mainly for development)' )
 @option( '-a', '--album-id', required=False, is_flag=True, default=False, help='treat provided id as album id' )
@@ -261,18 +278,30 @@ def show( ctx: ApplicationContext, album_id: bool, folder_id, item_id: bool, id:
 # noinspection PyShadowingNames
 @cli.command( help='sync' )
 # @option( '-a', '--album', required=False, is_flag=True, help='treat arguments as albums (the default)' ) # for now only sync albums
-@option( '-c', '--use-cache', required=False, is_flag=True, default=False, hidden=True, help='use filesize cache to detect updates (experimental)' )
+@option( '-c', '--use-cache', required=False, is_flag=True, default=False, hidden=True, help='also use filesizes to detect updates of items without change token (experimental)' )
 @option( '-d', '--destination', required=True, is_flag=False, help='destination folder to sync to' )
+@option( '-j', '--jobs', required=False, default=None, help='number of concurrent downloads', type=int )
+@option( '-b', '--batch-size', required=False, default=None, help='number of items to request in one call (1 disables batching)', type=int )
+@option( '-e', '--exif', required=False, is_flag=True, default=False, help='write exif data provided by the server into downloaded items' )
 @argument( 'albums', nargs=-1, required=False )
 @pass_obj
-def sync( ctx: ApplicationContext, albums: Tuple[str], destination: str, use_cache: bool ):
+def sync( ctx: ApplicationContext, albums: Tuple[str], destination: str, use_cache: bool, jobs: Optional[int], batch_size: Optional[int], exif: bool ):
+	from synophotos.downloader import DEFAULT_BATCH_SIZE, DEFAULT_JOBS, download_items
+	from synophotos.fsio import prepare_sync_albums, record_skips, remove_item
+
+	jobs = DEFAULT_JOBS if jobs is None else jobs
+	batch_size = DEFAULT_BATCH_SIZE if batch_size is None else batch_size
+
 	# get all existing items in all albums to be synced
 	all_albums = synophotos.albums( *albums, include_shared=True )
 	albums = { a: [] for a in all_albums }
 	for a in albums.keys():
 		albums[a] = synophotos.list_album_items( a.id )
 
-	result = prepare_sync_albums( albums, destination, use_cache )
+	result = prepare_sync_albums( albums, destination, ctx.cache, use_cache )
+
+	# skipped items are considered up to date, so their current change tokens serve as reference for the next sync
+	record_skips( result, ctx.cache )
 
 	if ( len( result.additions ), len( result.updates ), len( result.removals ) ) == (0, 0, 0 ):
 		pprint( f'Skipping {len( result.skips )} files, nothing to do ...' )
@@ -282,13 +311,21 @@ def sync( ctx: ApplicationContext, albums: Tuple[str], destination: str, use_cac
 	if not confirm( msg, ctx.force ):
 		return
 
-	for i, a in [ *result.additions, *result.updates ]:
-		item, contents = synophotos.download( item_id=i.id, passphrase=a.passphrase, thumbnail='compressed', include_exif=False ) # exif information should be included in compressed mode
-		ctx.cache.filesizes[item.id] = item.filesize
-		write_item( item, contents, result.fs )
+	# exif information should be included in compressed mode
+	downloads = download_items( synophotos, [ *result.additions, *result.updates ], result.fs, ctx.cache, jobs, thumbnail='compressed', batch_size=batch_size, include_exif=exif )
 	for p in result.removals:
 		remove_item( result.fs, p )
 
+	if downloads.failures:
+		print_error( f'failed to download {len( downloads.failures )} items:' )
+		for item, e in downloads.failures:
+			pp( f'  {item.filename} (id {item.id}): {e}' )
+
+	if downloads.exif_failures:
+		print_error( f'failed to write exif data of {len( downloads.exif_failures )} items, they will be downloaded again by the next sync:' )
+		for item, e in downloads.exif_failures:
+			pp( f'  {item.filename} (id {item.id}): {e}' )
+
 @cli.command( hidden=True, help='displays a selected payload (this is for development only)' )
 @argument( 'name', nargs=1, required=False )
 @pass_obj
@@ -317,7 +354,7 @@ def profile( ctx: ApplicationContext ):
 	pp( f'{pn} ( {p.account} at {p.url} )' )
 
 def _ws( ctx: ApplicationContext ) -> SynoPhotos:
-	return cast( SynoPhotos, ctx.service )
+	return cast( 'SynoPhotos', ctx.service )
 
 def main( *args, **kwargs ):
 	cli()  # trigger cli
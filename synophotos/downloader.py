@@ -0,0 +1,161 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from logging import DEBUG, getLogger
+from multiprocessing import get_context
+from os import cpu_count
+from traceback import format_exc
+from typing import Dict, List, Optional, Tuple
+
+from attrs import define, field
+from fs.osfs import OSFS
+
+from synophotos import Cache
+from synophotos.exif import SynoExif, exif_header
+from synophotos.fsio import discard_item, item_size, item_syspath, replace_header, write_archive, write_item_stream
+from synophotos.photos import Album, Item, SynoPhotos, ThumbnailSize
+
+log = getLogger( __name__ )
+
+DEFAULT_JOBS = 4
+DEFAULT_BATCH_SIZE = 20 # number of items requested in one call, 1 disables batching
+BATCH_MAX_FILESIZE = 16 * 1024 * 1024 # larger items (and videos) are downloaded one by one, so that their downloads can be resumed
+
+@define
+class DownloadResult:
+
+	downloads: List[Item] = field( factory=list )
+	failures: List[Tuple[Item, Exception]] = field( factory=list )
+	exif_failures: List[Tuple[Item, Exception]] = field( factory=list ) # items whose file has been removed again
+
+	def lengths( self ) -> Tuple[int, int, int]:
+		return len( self.downloads ), len( self.failures ), len( self.exif_failures )
+
+def download_items(
+	synophotos: SynoPhotos,
+	items: List[Tuple[Item, Album]],
+	fs: OSFS,
+	cache: Optional[Cache] = None,
+	jobs: int = DEFAULT_JOBS,
+	thumbnail: Optional[ThumbnailSize] = 'compressed',
+	batch_size: int = DEFAULT_BATCH_SIZE,
+	include_exif: bool = False,
+) -> DownloadResult:
+	"""
+	Downloads the provided items with a bounded number of worker threads, in batches where possible, and writes them to
+	the provided filesystem. Failures are collected instead of aborting the whole run. When include_exif is set, exif data
+	is written into each item by a pool of processes once its download has finished, each process rewrites the file it has
+	been handed. The cache is only updated from the calling thread.
+	"""
+	result = DownloadResult()
+	if not items:
+		return result
+
+	batches = _batches( items, thumbnail, batch_size )
+	jobs = max( 1, min( jobs, len( batches ) ) )
+	synophotos.transport.resize( max( jobs, synophotos.transport.pool_size ) )
+
+	exifs = synophotos.list_exif( [ i for i, a in items ] ) if include_exif else {}
+
+	# the process pool is started via spawn, as forking a process running download threads is not safe
+	processes = ProcessPoolExecutor( max_workers=cpu_count() or 1, mp_context=get_context( 'spawn' ) ) if include_exif else nullcontext()
+	with ThreadPoolExecutor( max_workers=jobs, thread_name_prefix='download' ) as executor, processes as pool:
+		# futures of batch downloads map to None, futures of exif workers map to their item
+		pending: Dict[Future, Optional[Item]] = { executor.submit( _download_batch, synophotos, batch, fs, thumbnail ): None for batch in batches }
+		while pending:
+			done, _ = wait( pending, return_when=FIRST_COMPLETED )
+			for future in done:
+				if ( item := pending.pop( future ) ) is not None:
+					if ( error := _exif_result( future, item, fs ) ) is None:
+						_record( result, cache, item, None, fs )
+					else:
+						result.exif_failures.append( ( item, error ) )
+					continue
+				for item, error in future.result():
+					if error is None and pool is not None:
+						pending[pool.submit( _write_exif, item_syspath( item, fs ), exifs.get( item.id, SynoExif() ), item )] = item
+					else:
+						_record( result, cache, item, error, fs )
+
+	log.info( f'download results (downloaded/failed/exif failed): {result.lengths()}' )
+
+	return result
+
+def _record( result: DownloadResult, cache: Optional[Cache], item: Item, error: Optional[Exception], fs: OSFS ) -> None:
+	if error is None:
+		if cache is not None:
+			cache.set_filesize( item.id, item.filesize )
+			cache.set_token( item.id, item.change_token )
+			cache.set_local_size( item.id, item_size( item, fs ) )
+		result.downloads.append( item )
+	else:
+		log.error( f'failed to download item {item.filename} (id {item.id}): {error}', exc_info=error if log.isEnabledFor( DEBUG ) else None )
+		result.failures.append( ( item, error ) )
+
+def _write_exif( path: str, exif: SynoExif, item: Item ) -> Optional[str]:
+	# runs in a worker process, whose log output is lost: errors are returned as formatted traceback instead
+	try:
+		if header := exif_header( path, exif, item ):
+			replace_header( path, *header )
+		return None
+	except Exception:
+		return format_exc()
+
+def _exif_result( future: Future, item: Item, fs: OSFS ) -> Optional[Exception]:
+	try:
+		details = future.result()
+	except Exception: # the worker process itself failed
+		details = format_exc()
+	if details is None:
+		return None
+
+	# the file is removed, otherwise the next sync would skip it and its exif data would never be written
+	error = RuntimeError( details.strip().splitlines()[-1] )
+	log.error( f'failed to write exif data of item {item.filename} (id {item.id}), removing it: {error}' )
+	log.debug( details )
+	try:
+		discard_item( item, fs )
+	except Exception as e:
+		log.warning( f'unable to remove item {item.filename} (id {item.id}): {e}' )
+	return error
+
+def _batches( items: List[Tuple[Item, Album]], thumbnail: Optional[ThumbnailSize], batch_size: int ) -> List[List[Tuple[Item, Album]]]:
+	# items of the same batch are matched to archive members by filename, so a filename must not appear twice within a batch
+	batches, batch, filenames = [], [], set()
+	for item, album in items:
+		if batch_size <= 1 or album.passphrase or thumbnail in ['sm', 'm', 'xl'] or item.type == 'video' or ( item.filesize or 0 ) > BATCH_MAX_FILESIZE:
+			batches.append( [( item, album )] )
+			continue
+		if len( batch ) >= batch_size or item.filename in filenames:
+			batches.append( batch )
+			batch, filenames = [], set()
+		batch.append( ( item, album ) )
+		filenames.add( item.filename )
+	if batch:
+		batches.append( batch )
+	return batches
+
+def _download_batch( synophotos: SynoPhotos, batch: List[Tuple[Item, Album]], fs: OSFS, thumbnail: Optional[ThumbnailSize] ) -> List[Tuple[Item, Optional[Exception]]]:
+	results, remaining = [], batch
+	if len( batch ) > 1:
+		try:
+			written = { i.id for i in write_archive( [ i for i, a in batch ], synophotos.stream_batch( [ i for i, a in batch ], thumbnail ), fs ) }
+			results = [ ( i, None ) for i, a in batch if i.id in written ]
+			remaining = [ ( i, a ) for i, a in batch if i.id not in written ]
+			if remaining:
+				log.debug( f'{len( remaining )} items missing from batch archive, downloading them one by one' )
+		except Exception as e:
+			log.warning( f'failed to download batch of {len( batch )} items, downloading them one by one: {e}' )
+
+	for item, album in remaining:
+		try:
+			_download_item( synophotos, item, album, fs, thumbnail )
+			results.append( ( item, None ) )
+		except Exception as e:
+			results.append( ( item, e ) )
+
+	return results
+
+def _download_item( synophotos: SynoPhotos, item: Item, album: Album, fs: OSFS, thumbnail: Optional[ThumbnailSize] ) -> None:
+	# the filesize of an item refers to the original, for other sizes the size reported by the server is used
+	expected_size = item.filesize if thumbnail in [None, 'original'] else None
+	write_item_stream( item, lambda offset: synophotos.stream( item, album.passphrase, thumbnail, offset ), fs, expected_size )
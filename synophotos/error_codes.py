@@ -3,6 +3,12 @@ from __future__ import annotations
 CODE_SUCCESS = 0
 CODE_UNKNOWN = 9999
 
+# codes indicating that the server is overloaded, see below
+BUSY_CODES = { 109, 110, 111, 117, 118 }
+
+# codes indicating that the session id sent with a request is no longer accepted
+SESSION_CODES = { 106, 107, 119 }
+
 # Source: pages 8 and 16 on https://global.download.synology.com/download/Document/Software/DeveloperGuide/Os/DSM/All/enu/DSM_Login_Web_API_Guide_enu.pdf
 error_codes = {
     CODE_SUCCESS: 'Success',
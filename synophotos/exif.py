@@ -3,12 +3,12 @@ from __future__ import annotations
 from datetime import datetime
 from logging import getLogger
 from re import compile as rx_compile
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 from attrs import define, field
-from exif import Image
 from more_itertools import first
 
+from synophotos.jpeg import ExifTags, read_header
 from synophotos.webservice import SynoResponse
 
 rx_lat_lon = rx_compile( r'(\d+)deg (\d+)\' (\d+)\"' )
@@ -25,8 +25,7 @@ class SynoExif:
 	def __attrs_post_init__( self ):
 		if self.response and self.response.success:
 			# who the f*** is resonsible for this response payload???
-			exif_list = first( self.response.data.get( 'list' ), {} ).get( 'exif', [] )
-			self.data = { x.get( 'key' ): x.get( 'value' ) for x in exif_list }
+			self.data = exif_data( first( self.response.data.get( 'list' ), {} ) )
 
 	@property
 	def city( self ):
@@ -120,7 +119,7 @@ class SynoExif:
 	def sub_location( self ):
 		return self.data.get( 'Sub Location' ) # sample value: 'Zoologischer Garten'
 
-	def set( self, img: Image, attribute, value ):
+	def set( self, img: ExifTags, attribute, value ):
 		if value is not None:
 			img.set( attribute, value )
 
@@ -151,6 +150,9 @@ class SynoExif:
 		pass
 
 	def apply( self, content: bytes, item ) -> bytes:
+		return self.tags( item ).apply( content )
+
+	def tags( self, item ) -> ExifTags:
 
 		# analysis:
 		# item.indexed: time the image was initially (?) indexed by Synology Photos (changing image metadata and triggering a re-index does not change this time!)
@@ -163,9 +165,9 @@ class SynoExif:
 		# exif.date_and_time: modification date from above (item.modified)
 		# exif.image_description: same description as above
 
-		img = Image( content )
+		img = ExifTags()
 
-		# all attributes at https://exif.readthedocs.io/en/latest/api_reference.html#image-attributes
+		# supported attributes are listed in jpeg.TAGS
 		# information on formats: https://en.wikipedia.org/wiki/Exif
 
 		# title / description
@@ -195,4 +197,30 @@ class SynoExif:
 		# location data
 		self.set_location_data( img )
 
-		return img.get_file()
+		return img
+
+def exif_data( element: Dict ) -> Dict:
+	return { x.get( 'key' ): x.get( 'value' ) for x in element.get( 'exif', [] ) }
+
+def exif_map( response: SynoResponse ) -> Dict[int, SynoExif]:
+	"""
+	Returns the exif data of all items contained in a response to GET_EXIF, mapped by item id.
+	"""
+	if not response.success:
+		log.warning( f'unable to fetch exif data: code={response.error_code}, msg={response.error_msg}' )
+		return {}
+	return { e.get( 'id' ): SynoExif( data=exif_data( e ) ) for e in response.data.get( 'list', [] ) }
+
+def exif_header( path: str, exif: SynoExif, item ) -> Optional[Tuple[int, bytes]]:
+	"""
+	Reads the header segments of the JPEG file at path and writes the provided exif data into them. Only the header is read
+	and returned, so this can run in another process without handing over the image data.
+
+	:return: length of the original header and the new header, or None if the file is not to be changed
+	"""
+	with open( path, 'rb' ) as f:
+		header = read_header( f )
+	if not header:
+		return None
+	updated = exif.apply( header, item )
+	return ( len( header ), updated ) if updated != header else None
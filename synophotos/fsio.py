@@ -1,16 +1,34 @@
+from itertools import chain
+from json import dumps, loads
 from logging import getLogger
-from os.path import dirname
-from typing import Dict, List, Optional, Tuple
+from os import replace, scandir
+from os.path import basename, dirname, splitext
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from typing import Callable, Dict, List, Optional, Tuple
+from zipfile import ZipFile, is_zipfile
 
 from attrs import define, field
-from click import get_current_context
 from fs.osfs import OSFS
 
 from synophotos import Cache
 from synophotos.photos import Album, Item
+from synophotos.webservice import DEFAULT_CHUNK_SIZE, SynoResponse
 
 log = getLogger( __name__ )
 
+ARCHIVE_SPOOL_SIZE = 64 * 1024 * 1024 # archives larger than this are spooled to a temporary file instead of memory
+
+PART_SUFFIX = '.part' # suffix of partially downloaded files
+PART_META_SUFFIX = '.part.json' # suffix of files recording item id and expected size of a partial download
+
+# extensions of files which are considered for removal during sync
+MEDIA_EXTENSIONS = {
+	'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp', '.heic', '.heif',
+	'.arw', '.cr2', '.cr3', '.dng', '.nef', '.orf', '.raf', '.rw2',
+	'.mp4', '.m4v', '.mov', '.avi', '.mkv', '.mts', '.m2ts', '.3gp', '.mpg', '.mpeg', '.wmv',
+}
+
 @define
 class SyncResult:
 
@@ -19,29 +37,40 @@ class SyncResult:
 	updates: List[Tuple[Item, Album]] = field( factory=list )
 	skips: List[Tuple[Item, Album]] = field( factory=list )
 	removals: List[str] = field( factory=list )
+	sizes: Dict[str, int] = field( factory=dict ) # sizes of the files in the destination, mapped by path
 
 	def lengths( self ) -> Tuple[int, int, int, int]:
 		return len( self.additions ), len( self.updates ), len( self.removals ), len( self.skips )
 
-def prepare_sync_albums( albums: Dict[Album, List[Item]], destination: str, use_cache: bool = False ) -> SyncResult:
+def prepare_sync_albums( albums: Dict[Album, List[Item]], destination: str, cache: Optional[Cache] = None, use_cache: bool = False ) -> SyncResult:
+	"""
+	Compares the items of the provided albums with the content of the destination. Existing items are updated when their
+	size on disk differs from the size recorded after they have been written (the file is incomplete or has been changed
+	locally) or when their change token differs from the one recorded in the cache during the last sync. Items without a
+	recorded token are only updated when use_cache is set and their filesize has changed (this is how updates have been
+	detected before).
+	"""
+	cache = cache if cache is not None else Cache()
 	if use_cache:
-		cache = get_current_context().obj.cache
 		log.info( f'using cache with {len( cache.filesizes )} filesize entries to detect updates' )
-	else:
-		cache = None
 
 	fs = OSFS( root_path=destination, expand_vars=True, create=True )
 	result = SyncResult( fs = fs )
 
+	# take one snapshot of the destination instead of checking each item separately
+	existing = result.sizes = scan_files( fs.getsyspath( '/' ) )
+
 	for album, item_list in albums.items():
 		for item in item_list:
 			# path = f'/{album.id} - {album.name}/{item.filename}' # don't use album name as it might contain characters which cannot be used in filenames
-			if not fs.exists( _item_path( item ) ):
+			if ( size := existing.get( _item_path( item ) ) ) is None:
 				result.additions.append( ( item, album ) )
-			elif cache and not cache.cmp_filesize( item.id, item.filesize ):
-				# todo: updates seem (almost) impossible as items do not have a last_modified field
-				# work around: remember file sizes and check if there are any changes
-				result.updates.append( (item, album ) )
+			elif ( local_size := cache.get_local_size( item.id ) ) is not None and local_size != size:
+				result.updates.append( ( item, album ) )
+			elif ( token := cache.get_token( item.id ) ) is not None and token != item.change_token:
+				result.updates.append( ( item, album ) )
+			elif token is None and use_cache and not cache.cmp_filesize( item.id, item.filesize ):
+				result.updates.append( ( item, album ) )
 			else:
 				result.skips.append( (item, album ) )
 
@@ -51,22 +80,162 @@ def prepare_sync_albums( albums: Dict[Album, List[Item]], destination: str, use_
 	result.skips = list( {i.id: (i, a) for i, a in result.skips}.values() )
 
 	# check for removals
-	paths = [ _item_path( r[0] ) for r in result.additions ]
-	paths.extend( [ _item_path( r[0] ) for r in result.updates ] )
-	paths.extend( [ _item_path( r[0] ) for r in result.skips ] )
-	for f in fs.walk.files( filter=[ '*.jpg', '*.jpeg' ] ):
-		if f not in paths:
-			result.removals.append( f )
+	paths = { _item_path( i ) for i, a in chain( result.additions, result.updates, result.skips ) }
+	result.removals = sorted( f for f in existing if f not in paths and splitext( f )[1].lower() in MEDIA_EXTENSIONS )
 
 	log.info( f'sync result preparation (add/update/remove/skip): {result.lengths()}' )
 
 	return result
 
-def write_item( item: Item, contents: bytes, fs: OSFS ):
+def record_skips( result: SyncResult, cache: Cache ) -> None:
+	"""
+	Records change tokens of skipped items which do not have one yet (they have been synced before tokens were recorded),
+	so that they serve as reference for the next sync, together with the size of the file on disk. As a file might be
+	incomplete, this is only done when its size matches the filesize of the item, compressed files whose size cannot be
+	verified keep being checked via the filesize cache.
+	"""
+	for item, album in result.skips:
+		size = result.sizes.get( _item_path( item ) )
+		if cache.get_token( item.id ) is None and size == item.filesize:
+			cache.set_token( item.id, item.change_token )
+			cache.set_local_size( item.id, size )
+
+def scan_files( root: str ) -> Dict[str, int]:
+	"""
+	Walks the provided directory once and returns the paths of all contained files together with their sizes, relative to
+	root and in the notation of PyFilesystem (i.e. '/folder/file.jpg').
+	"""
+	files, dirs = {}, [ ( root, '' ) ]
+	while dirs:
+		path, relpath = dirs.pop()
+		with scandir( path ) as entries:
+			for entry in entries:
+				if entry.is_dir( follow_symlinks=False ):
+					dirs.append( ( entry.path, f'{relpath}/{entry.name}' ) )
+				elif entry.is_file():
+					files[f'{relpath}/{entry.name}'] = entry.stat().st_size
+	return files
+
+def write_item_stream( item: Item, request: Callable[[int], SynoResponse], fs: OSFS, expected_size: Optional[int] = None ) -> int:
 	path = _item_path( item )
+	written = write_resumable( request, fs, path, item.id, expected_size )
+	log.info( f'saved item {item.id} to {fs.getsyspath( path )}, wrote {written} bytes' )
+	return written
+
+def write_resumable( request: Callable[[int], SynoResponse], fs: OSFS, path: str, item_id: int, expected_size: Optional[int] = None ) -> int:
+	"""
+	Downloads content to a partial file next to path, which is moved to path once it is complete. Together with the partial
+	file, item id and expected size are recorded. If a partial file of the same item exists, the download is resumed from its
+	end via a range request, unless the server ignores the range or reports a different total size.
+
+	:param request: function sending the download request, receives the offset to start the download at
+	:param fs: destination filesystem
+	:param path: destination path
+	:param item_id: id of the downloaded item
+	:param expected_size: expected size of the complete content, when None the size reported by the server is used
+	:return: number of bytes written by this call
+	"""
+	part, meta = f'{path}{PART_SUFFIX}', f'{path}{PART_META_SUFFIX}'
 	fs.makedirs( dirname( path ), recreate=True )
-	fs.writebytes( path, contents )
-	log.info( f'saved item {item.id} to {fs.getsyspath( path )}, wrote {item.filesize} bytes' )
+
+	offset, recorded_size = _resume_offset( fs, part, meta, item_id, expected_size )
+
+	# the partial file is opened before the request is sent, so that a failing filesystem does not leave a response open
+	with fs.openbin( part, 'a' if offset else 'w' ) as f:
+		response = request( offset )
+		if offset and ( response.status_code != 206 or _content_size( response, offset ) != recorded_size ):
+			log.debug( f'unable to resume download of {path} at offset {offset} (status {response.status_code}), starting over' )
+			response.close()
+			f.seek( 0 )
+			f.truncate()
+			offset, response = 0, request( 0 )
+
+		# the response is closed on any error, otherwise it would keep its connection and its slot in the limiter
+		with response:
+			if not response.success:
+				raise RuntimeError( f'unable to download {path}: status={response.status_code}, code={response.error_code}, msg={response.error_msg}' )
+
+			expected_size = expected_size if expected_size is not None else _content_size( response, offset )
+			fs.writetext( meta, dumps( { 'id': item_id, 'size': expected_size } ) )
+
+			written = 0
+			for chunk in response.iter_bytes():
+				written += f.write( chunk )
+
+	if expected_size is not None and offset + written != expected_size:
+		if offset + written > expected_size:
+			_remove_part( fs, part, meta )
+		raise RuntimeError( f'incomplete download of {path}: expected {expected_size} bytes, got {offset + written}' )
+
+	fs.move( part, path, overwrite=True )
+	fs.remove( meta )
+	if offset:
+		log.debug( f'resumed download of {path} at offset {offset}' )
+	return written
+
+def write_archive( items: List[Item], response: SynoResponse, fs: OSFS ) -> List[Item]:
+	"""
+	Unpacks a zip archive containing several items into the provided filesystem. Archive members are matched to items by
+	filename, so filenames need to be unique among the provided items. The archive needs to be spooled (zip archives keep
+	their directory at the end), members are then copied chunk by chunk to a partial file, which is moved to its destination
+	once its size has been checked.
+
+	:return: list of items which have been written, items not contained in the archive are missing
+	"""
+	written = []
+	with response, SpooledTemporaryFile( max_size=ARCHIVE_SPOOL_SIZE ) as archive:
+		if not response.success:
+			raise RuntimeError( f'unable to download archive: status={response.status_code}, code={response.error_code}, msg={response.error_msg}' )
+
+		for chunk in response.iter_bytes():
+			archive.write( chunk )
+		archive.seek( 0 )
+
+		if not is_zipfile( archive ):
+			raise RuntimeError( f'expected zip archive for {len( items )} items, but received something else' )
+
+		remaining = { i.filename: i for i in items }
+		with ZipFile( archive ) as zf:
+			for info in zf.infolist():
+				if info.is_dir() or not ( item := remaining.pop( basename( info.filename ), None ) ):
+					continue
+				path = _item_path( item )
+				part, meta = f'{path}{PART_SUFFIX}', f'{path}{PART_META_SUFFIX}'
+				fs.makedirs( dirname( path ), recreate=True )
+				_remove_part( fs, part, meta )
+				with zf.open( info ) as src, fs.openbin( part, 'w' ) as dst:
+					copyfileobj( src, dst, DEFAULT_CHUNK_SIZE )
+				if fs.getsize( part ) != info.file_size:
+					log.warning( f'incomplete extraction of item {item.id}: expected {info.file_size} bytes, got {fs.getsize( part )}' )
+					fs.remove( part )
+					continue
+				fs.move( part, path, overwrite=True )
+				log.info( f'saved item {item.id} to {fs.getsyspath( path )}, wrote {info.file_size} bytes' )
+				written.append( item )
+
+	return written
+
+def replace_header( path: str, length: int, header: bytes ) -> None:
+	"""
+	Replaces the first length bytes of the file at path (a system path, as this runs in exif worker processes) with header.
+	The remaining content is copied chunk by chunk to a partial file next to it, which then replaces the original file.
+	"""
+	part = f'{path}{PART_SUFFIX}'
+	with open( path, 'rb' ) as src, open( part, 'wb' ) as dst:
+		dst.write( header )
+		src.seek( length )
+		copyfileobj( src, dst, DEFAULT_CHUNK_SIZE )
+	replace( part, path )
+
+def item_syspath( item: Item, fs: OSFS ) -> str:
+	return fs.getsyspath( _item_path( item ) )
+
+def item_size( item: Item, fs: OSFS ) -> int:
+	return fs.getsize( _item_path( item ) )
+
+def discard_item( item: Item, fs: OSFS ) -> None:
+	if fs.exists( path := _item_path( item ) ):
+		remove_item( fs, path )
 
 def remove_item( fs: OSFS, path: str ):
 	fs.remove( path )
@@ -75,6 +244,35 @@ def remove_item( fs: OSFS, path: str ):
 	if not fs.listdir( dirname( path ) ):
 		fs.removedir( dirname( path ) )
 
+def _resume_offset( fs: OSFS, part: str, meta: str, item_id: int, expected_size: Optional[int] ) -> Tuple[int, Optional[int]]:
+	# returns the offset to resume a partial download at together with the recorded size, stale partial files are removed
+	try:
+		recorded = loads( fs.readtext( meta ) ) if fs.exists( part ) and fs.exists( meta ) else {}
+	except ValueError:
+		recorded = {}
+
+	size, recorded_size = fs.getsize( part ) if recorded else 0, recorded.get( 'size' )
+	if recorded.get( 'id' ) == item_id and recorded_size and ( expected_size is None or recorded_size == expected_size ) and 0 < size < recorded_size:
+		return size, recorded_size
+
+	_remove_part( fs, part, meta )
+	return 0, None
+
+def _remove_part( fs: OSFS, part: str, meta: str ) -> None:
+	for path in [ part, meta ]:
+		if fs.exists( path ):
+			fs.remove( path )
+
+def _content_size( response: SynoResponse, offset: int ) -> Optional[int]:
+	# total size of the content, derived from a content-range header (partial responses) or the content length
+	headers = response.response.headers
+	if response.status_code == 206 and ( content_range := headers.get( 'Content-Range' ) ):
+		total = content_range.rsplit( '/', 1 )[-1]
+		return int( total ) if total.isdigit() else None
+	if ( length := headers.get( 'Content-Length' ) ) and length.isdigit():
+		return offset + int( length ) if response.status_code == 206 else int( length )
+	return None
+
 def _item_path( item: Item ) -> str:
 	# path = f'/{album.id} - {album.name}/{item.filename}' # don't use album name as it might contain characters which cannot be used in filenames
 	return f'/{item.folder_id}/{item.filename}'
@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+from json import dumps, loads
+from logging import getLogger
+from sqlite3 import Connection, connect
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, TypeVar
+
+from attrs import asdict, define, field
+from more_itertools import chunked
+
+from synophotos import INDEX_MAX_AGE
+from synophotos.webservice import structure
+
+log = getLogger( __name__ )
+
+T = TypeVar( 'T' )
+
+MAX_VARIABLES = 500 # older versions of SQLite do not allow more than 999 variables per statement
+
+SCHEMA = [
+	'CREATE TABLE IF NOT EXISTS albums ( id INTEGER PRIMARY KEY, data TEXT NOT NULL )',
+	'CREATE TABLE IF NOT EXISTS folders ( id INTEGER PRIMARY KEY, parent INTEGER, data TEXT NOT NULL )',
+	'CREATE TABLE IF NOT EXISTS items ( id INTEGER PRIMARY KEY, folder_id INTEGER, data TEXT NOT NULL )',
+	'DROP TABLE IF EXISTS album_items', # album membership has been recorded by earlier versions, but was never read
+	# a listing is an ordered list of element ids as returned by the server, i.e. the albums, the subfolders of a folder or the items of a folder
+	'CREATE TABLE IF NOT EXISTS listings ( key TEXT PRIMARY KEY, ids TEXT NOT NULL, version INTEGER, updated_at TEXT NOT NULL )',
+	# exif data of items together with the change token of the item at the time the data has been fetched
+	'CREATE TABLE IF NOT EXISTS exif ( id INTEGER PRIMARY KEY, token TEXT NOT NULL, data TEXT NOT NULL )',
+]
+
+TABLES = { 'Album': 'albums', 'Folder': 'folders', 'Item': 'items' }
+
+@define
+class MetadataIndex:
+	# sqlite backed index of albums, folders and items, a listing is fresh if younger than max_age (and of the expected version)
+
+	path: str = field( default=':memory:' )
+	max_age: timedelta = field( default=INDEX_MAX_AGE )
+	refresh: bool = field( default=False )
+
+	_db: Connection = field( init=False, default=None )
+	_lock: RLock = field( init=False, factory=RLock )
+
+	def __attrs_post_init__( self ):
+		self._db = connect( self.path, check_same_thread=False )
+		with self._db:
+			for statement in SCHEMA:
+				self._db.execute( statement )
+		log.debug( f'opened metadata index at {self.path}' )
+
+	def close( self ) -> None:
+		with self._lock:
+			self._db.close()
+
+	# listings
+
+	def is_fresh( self, key: str, version: Optional[int] = None ) -> bool:
+		if self.refresh:
+			return False
+		with self._lock:
+			row = self._db.execute( 'SELECT version, updated_at FROM listings WHERE key = ?', ( key, ) ).fetchone()
+		if not row or ( version is not None and row[0] != version ):
+			return False
+		return datetime.utcnow() - datetime.fromisoformat( row[1] ) < self.max_age
+
+	def listing( self, key: str, cls: Type[T], version: Optional[int] = None ) -> Optional[List[T]]:
+		if not self.is_fresh( key, version ):
+			return None
+
+		table = TABLES[cls.__name__]
+		with self._lock:
+			ids = loads( self._db.execute( 'SELECT ids FROM listings WHERE key = ?', ( key, ) ).fetchone()[0] )
+			elements = {}
+			for chunk in chunked( ids, MAX_VARIABLES ):
+				placeholders = ','.join( '?' * len( chunk ) )
+				elements.update( self._db.execute( f'SELECT id, data FROM {table} WHERE id IN ( {placeholders} )', chunk ).fetchall() )
+
+		if len( elements ) < len( set( ids ) ): # elements have been removed in the meantime
+			return None
+
+		return [ structure( loads( elements[id] ), cls ) for id in ids ]
+
+	def put_listing( self, key: str, elements: Iterable[T], version: Optional[int] = None ) -> List[T]:
+		elements = list( elements )
+		with self._lock, self._db:
+			self.put_elements( elements )
+			self.put_ids( key, [ e.id for e in elements ], version )
+		return elements
+
+	def put_elements( self, elements: Iterable ) -> None:
+		# allows storing a listing page by page, see put_ids()
+		with self._lock, self._db:
+			for e in elements:
+				self._upsert( e )
+
+	def put_ids( self, key: str, ids: List[int], version: Optional[int] = None ) -> None:
+		with self._lock, self._db:
+			self._db.execute( 'INSERT OR REPLACE INTO listings ( key, ids, version, updated_at ) VALUES ( ?, ?, ?, ? )', ( key, dumps( ids ), version, datetime.utcnow().isoformat() ) )
+			if key == albums_key( True ):
+				self._remove_albums( ids )
+
+	def remove_listing( self, key: str ) -> None:
+		with self._lock, self._db:
+			self._db.execute( 'DELETE FROM listings WHERE key = ?', ( key, ) )
+
+	# exif data
+
+	def exif( self, tokens: Dict[int, str] ) -> Dict[int, Dict]:
+		# tokens: item id -> change token, data of changed items is omitted
+		if self.refresh:
+			return {}
+		rows = []
+		with self._lock:
+			for chunk in chunked( tokens.keys(), MAX_VARIABLES ):
+				placeholders = ','.join( '?' * len( chunk ) )
+				rows.extend( self._db.execute( f'SELECT id, token, data FROM exif WHERE id IN ( {placeholders} )', chunk ).fetchall() )
+		return { id: loads( data ) for id, token, data in rows if tokens.get( id ) == token }
+
+	def put_exif( self, exif: Dict[int, Tuple[str, Dict]] ) -> None:
+		# exif: item id -> ( change token, data )
+		with self._lock, self._db:
+			self._db.executemany( 'INSERT OR REPLACE INTO exif ( id, token, data ) VALUES ( ?, ?, ? )', [ ( id, token, dumps( data ) ) for id, ( token, data ) in exif.items() ] )
+
+	# helpers
+
+	def _remove_albums( self, existing_ids: List[int] ) -> None:
+		existing_ids = set( existing_ids )
+		removed = [ r[0] for r in self._db.execute( 'SELECT id FROM albums' ) if r[0] not in existing_ids ]
+		for id in removed:
+			self._db.execute( 'DELETE FROM albums WHERE id = ?', ( id, ) )
+			self._db.execute( 'DELETE FROM listings WHERE key = ?', ( album_items_key( id ), ) )
+		if removed:
+			log.debug( f'removed albums {removed} from metadata index' )
+
+	def _upsert( self, element ) -> None:
+		data = dumps( _compact( asdict( element ) ) )
+		name = element.__class__.__name__
+		if name == 'Folder':
+			self._db.execute( 'INSERT OR REPLACE INTO folders ( id, parent, data ) VALUES ( ?, ?, ? )', ( element.id, element.parent, data ) )
+		elif name == 'Item':
+			self._db.execute( 'INSERT OR REPLACE INTO items ( id, folder_id, data ) VALUES ( ?, ?, ? )', ( element.id, element.folder_id, data ) )
+		else:
+			self._db.execute( f'INSERT OR REPLACE INTO {TABLES[name]} ( id, data ) VALUES ( ?, ? )', ( element.id, data ) )
+
+# remove None values, so defaults will be used when structuring the data again
+def _compact( data: Any ) -> Any:
+	if isinstance( data, dict ):
+		return { k: _compact( v ) for k, v in data.items() if v is not None }
+	return data
+
+# listing keys
+
+def albums_key( include_shared: bool ) -> str:
+	return 'albums:all' if include_shared else 'albums:normal'
+
+def root_key() -> str:
+	return 'root'
+
+def folders_key( parent_id: int ) -> str:
+	return f'folders:{parent_id}'
+
+def folder_items_key( folder_id: int ) -> str:
+	return f'folder_items:{folder_id}'
+
+def album_items_key( album_id: int ) -> str:
+	return f'album_items:{album_id}'
@@ -0,0 +1,235 @@
+from fractions import Fraction
+from logging import getLogger
+from struct import Struct, error as StructError
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+from attrs import define, field
+
+log = getLogger( __name__ )
+
+SOI = b'\xff\xd8'
+EXIF_HEADER = b'Exif\x00\x00'
+MAX_SEGMENT_LENGTH = 0xFFFF # segment length field including itself
+
+# markers
+APP0, APP1, SOS, EOI = 0xE0, 0xE1, 0xDA, 0xD9
+STANDALONE_MARKERS = { 0x01, *range( 0xD0, 0xD8 ) } # markers without length field
+
+# ifds
+IFD0, EXIF_IFD, GPS_IFD = 'ifd0', 'exif', 'gps'
+IFD_POINTERS = { EXIF_IFD: 0x8769, GPS_IFD: 0x8825 } # tags in ifd0 pointing to sub ifds
+
+# field types
+BYTE, ASCII, SHORT, LONG, RATIONAL = 1, 2, 3, 4, 5
+TYPE_SIZES = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8 }
+
+# supported attributes (named like in the exif package, which has been used before): attribute -> ifd, tag, type
+TAGS: Dict[str, Tuple[str, int, int]] = {
+	'image_description': ( IFD0, 0x010E, ASCII ),
+	'datetime': ( IFD0, 0x0132, ASCII ),
+	'datetime_original': ( EXIF_IFD, 0x9003, ASCII ),
+	'datetime_digitized': ( EXIF_IFD, 0x9004, ASCII ),
+	'offset_time': ( EXIF_IFD, 0x9010, ASCII ),
+	'offset_time_original': ( EXIF_IFD, 0x9011, ASCII ),
+	'offset_time_digitized': ( EXIF_IFD, 0x9012, ASCII ),
+	'gps_version_id': ( GPS_IFD, 0x0000, BYTE ),
+	'gps_latitude_ref': ( GPS_IFD, 0x0001, ASCII ),
+	'gps_latitude': ( GPS_IFD, 0x0002, RATIONAL ),
+	'gps_longitude_ref': ( GPS_IFD, 0x0003, ASCII ),
+	'gps_longitude': ( GPS_IFD, 0x0004, RATIONAL ),
+}
+
+GPS_VERSION = ( 2, 2, 0, 0 )
+
+Value = Union[str, int, float, Iterable]
+
+@define
+class ExifTags:
+	"""
+	Collects EXIF attributes and writes them into JPEG files. Only the APP1 segment carrying the EXIF data is rebuilt, all
+	other segments and the compressed image data are copied unchanged, without being decoded. Existing EXIF data is kept
+	as it is: the original TIFF structure stays in place and changed IFDs are appended to it, so that offsets of untouched
+	data (maker notes, thumbnails) remain valid. The cost of apply() therefore does not depend on the size of the image.
+	"""
+
+	values: Dict[str, Dict[int, Tuple[int, int, bytes]]] = field( factory=lambda: { IFD0: {}, EXIF_IFD: {}, GPS_IFD: {} } ) # ifd -> tag -> type, count, value
+
+	def set( self, attribute: str, value: Value ) -> None:
+		ifd, tag, ftype = TAGS[attribute]
+		self.values[ifd][tag] = _pack_value( ftype, value )
+		if ifd == GPS_IFD and attribute != 'gps_version_id':
+			self.values[ifd].setdefault( TAGS['gps_version_id'][1], _pack_value( BYTE, GPS_VERSION ) )
+
+	def apply( self, content: Union[bytes, memoryview] ) -> bytes:
+		"""
+		Returns content with the collected attributes written into its EXIF segment. Content which is not a JPEG file or
+		where the resulting segment would exceed the maximum segment size is returned unchanged.
+		"""
+		return b''.join( self.chunks( content ) )
+
+	def chunks( self, content: Union[bytes, memoryview] ) -> List[Union[bytes, memoryview]]:
+		"""
+		Same as apply(), but returns the result as list of chunks: everything except the new EXIF segment is a view into
+		content, so that writing the chunks to a file does not copy the image data in memory.
+		"""
+		content = memoryview( content )
+		if content[:2] != SOI:
+			log.debug( 'unable to write exif data: content is not a jpeg file' )
+			return [ content ]
+
+		try:
+			start, end, insert_at = _find_exif_segment( content )
+			tiff = rebuild_tiff( content[start + 4 + len( EXIF_HEADER ):end] if start is not None else None, self.values )
+		except ( StructError, ValueError ) as e:
+			log.warning( f'unable to write exif data: {e}' )
+			return [ content ]
+
+		length = 2 + len( EXIF_HEADER ) + len( tiff )
+		if length > MAX_SEGMENT_LENGTH:
+			log.warning( f'unable to write exif data: exif segment would exceed {MAX_SEGMENT_LENGTH} bytes' )
+			return [ content ]
+
+		segment = b''.join( [ b'\xff', bytes( [ APP1 ] ), Struct( '>H' ).pack( length ), EXIF_HEADER, tiff ] )
+		if start is None:
+			return [ content[:insert_at], segment, content[insert_at:] ]
+		return [ content[:start], segment, content[end:] ]
+
+def read_header( f: BinaryIO ) -> bytes:
+	"""
+	Reads the segments preceding the compressed image data of a JPEG file (this is where EXIF data is located) and returns
+	them, starting with SOI. Only segment headers are visited, the image data is not read. Returns b'' for other files.
+	"""
+	if f.read( 2 ) != SOI:
+		return b''
+
+	offset = 2
+	while len( head := f.read( 4 ) ) == 4 and head[0] == 0xFF:
+		if head[1] == 0xFF: # fill byte
+			offset += 1
+		elif head[1] in STANDALONE_MARKERS:
+			offset += 2
+		elif head[1] in [ SOS, EOI ]:
+			break
+		else:
+			offset += 2 + Struct( '>H' ).unpack_from( head, 2 )[0]
+		f.seek( offset )
+
+	f.seek( 0 )
+	return f.read( offset )
+
+def _find_exif_segment( content: memoryview ) -> Tuple[Optional[int], Optional[int], int]:
+	# walks the segment headers up to the start of the image data, returns start and end of an existing exif segment and
+	# the offset where a new exif segment is to be inserted (after SOI, or after APP0 for JFIF files)
+	offset, insert_at = 2, 2
+	while offset + 4 <= len( content ):
+		if content[offset] != 0xFF:
+			raise ValueError( f'invalid jpeg marker at offset {offset}' )
+		marker = content[offset + 1]
+		if marker == 0xFF: # fill byte
+			offset += 1
+			continue
+		if marker in STANDALONE_MARKERS:
+			offset += 2
+			continue
+		if marker in [ SOS, EOI ]:
+			break
+
+		end = offset + 2 + Struct( '>H' ).unpack_from( content, offset + 2 )[0]
+		if marker == APP1 and content[offset + 4:offset + 4 + len( EXIF_HEADER )] == EXIF_HEADER:
+			return offset, end, insert_at
+		if marker == APP0 and offset == 2:
+			insert_at = end
+		offset = end
+
+	return None, None, insert_at
+
+def rebuild_tiff( tiff: Optional[memoryview], values: Dict[str, Dict[int, Tuple[int, int, bytes]]] ) -> bytes:
+	"""
+	Returns a TIFF structure (the payload of an EXIF segment) containing the provided values. The original structure is
+	copied, IFDs containing changes are appended to it and the header is updated to point to the new IFD0.
+	"""
+	if tiff is None or len( tiff ) < 8:
+		tiff, order, ifd0_offset = None, '<', None
+	else:
+		order = { b'II': '<', b'MM': '>' }.get( bytes( tiff[:2] ) )
+		if order is None:
+			raise ValueError( 'invalid byte order in tiff header' )
+		ifd0_offset = Struct( f'{order}I' ).unpack_from( tiff, 4 )[0]
+
+	out = bytearray( tiff if tiff is not None else b'II\x2a\x00\x00\x00\x00\x00' )
+	ifd0, next_ifd = _read_ifd( out, ifd0_offset, order ) if ifd0_offset else ( {}, 0 )
+
+	ifd0 = { **ifd0, **{ tag: _entry( v, order ) for tag, v in values[IFD0].items() } }
+	for ifd, pointer in IFD_POINTERS.items():
+		if not values[ifd]:
+			continue
+		# the sub ifd is copied when it exists, a pointer of another type than long is considered broken and ignored
+		entries = _read_ifd( out, _entry_long( ifd0[pointer], order ), order )[0] if pointer in ifd0 and _entry_long( ifd0[pointer], order ) else {}
+		entries = { **entries, **{ tag: _entry( v, order ) for tag, v in values[ifd].items() } }
+		ifd0[pointer] = _entry( _pack_value( LONG, _append_ifd( out, entries, 0, order ) ), order )
+
+	Struct( f'{order}I' ).pack_into( out, 4, _append_ifd( out, ifd0, next_ifd, order ) )
+	return bytes( out )
+
+# ifd entries are kept as (type, count, value) for new values and as raw 12 byte entries for existing ones, which refer to
+# data in the original structure and are therefore copied as they are
+
+Entry = Union[bytes, Tuple[int, int, bytes]]
+
+def _read_ifd( tiff: bytearray, offset: int, order: str ) -> Tuple[Dict[int, Entry], int]:
+	count = Struct( f'{order}H' ).unpack_from( tiff, offset )[0]
+	if offset + 2 + 12 * count + 4 > len( tiff ):
+		raise ValueError( f'ifd at offset {offset} exceeds exif data' )
+	entries = { Struct( f'{order}H' ).unpack_from( tiff, o )[0]: bytes( tiff[o:o + 12] ) for o in range( offset + 2, offset + 2 + 12 * count, 12 ) }
+	return entries, Struct( f'{order}I' ).unpack_from( tiff, offset + 2 + 12 * count )[0]
+
+def _append_ifd( tiff: bytearray, entries: Dict[int, Entry], next_ifd: int, order: str ) -> int:
+	# appends an ifd followed by the values not fitting into entries, returns the offset of the ifd
+	if len( tiff ) % 2:
+		tiff.append( 0 ) # ifds and values start at word boundaries
+	offset = len( tiff )
+	data_offset = offset + 2 + 12 * len( entries ) + 4
+	raw, data = [ Struct( f'{order}H' ).pack( len( entries ) ) ], []
+	for tag in sorted( entries ):
+		entry = entries[tag]
+		if isinstance( entry, tuple ):
+			ftype, count, value = entry
+			if len( value ) > 4:
+				entry = Struct( f'{order}HHII' ).pack( tag, ftype, count, data_offset )
+				data.append( value + b'\x00' * ( len( value ) % 2 ) )
+				data_offset += len( data[-1] )
+			else:
+				entry = Struct( f'{order}HHI' ).pack( tag, ftype, count ) + value.ljust( 4, b'\x00' )
+		raw.append( entry )
+	raw.append( Struct( f'{order}I' ).pack( next_ifd ) )
+	tiff.extend( b''.join( raw + data ) )
+	return offset
+
+def _entry( value: Tuple[int, int, bytes], order: str ) -> Tuple[int, int, bytes]:
+	# values are packed in big endian order by _pack_value(), convert them if necessary
+	ftype, count, packed = value
+	if order == '>' or TYPE_SIZES[ftype] == 1:
+		return value
+	size = TYPE_SIZES[ftype] if ftype not in [ 5, 10 ] else 4 # rationals consist of two longs
+	return ftype, count, b''.join( packed[i:i + size][::-1] for i in range( 0, len( packed ), size ) )
+
+def _entry_long( entry: Entry, order: str ) -> int:
+	ftype, count, value = entry if isinstance( entry, tuple ) else Struct( f'{order}HI4s' ).unpack_from( entry, 2 )
+	return Struct( f'{order}I' ).unpack( value )[0] if ftype == LONG and count == 1 else 0
+
+def _pack_value( ftype: int, value: Value ) -> Tuple[int, int, bytes]:
+	# returns type, count and value in big endian order
+	if ftype == ASCII:
+		packed = str( value ).encode( 'UTF-8' ) + b'\x00'
+		return ftype, len( packed ), packed
+	values: List = list( value ) if isinstance( value, ( tuple, list ) ) else [ value ]
+	if ftype == BYTE:
+		return ftype, len( values ), bytes( int( v ) for v in values )
+	if ftype == SHORT:
+		return ftype, len( values ), b''.join( Struct( '>H' ).pack( int( v ) ) for v in values )
+	if ftype == LONG:
+		return ftype, len( values ), b''.join( Struct( '>I' ).pack( int( v ) ) for v in values )
+	if ftype == RATIONAL:
+		fractions = [ Fraction( v ).limit_denominator( 1_000_000 ) for v in values ]
+		return ftype, len( values ), b''.join( Struct( '>II' ).pack( f.numerator, f.denominator ) for f in fractions )
+	raise ValueError( f'unsupported field type {ftype}' )
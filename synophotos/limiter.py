@@ -0,0 +1,89 @@
+from logging import getLogger
+from threading import Condition
+from typing import Dict, Optional
+
+from attrs import define, field
+
+from synophotos.error_codes import BUSY_CODES
+
+log = getLogger( __name__ )
+
+DEFAULT_MIN_REQUESTS = 1
+DEFAULT_MAX_REQUESTS = 8
+
+BUSY_STATUS_CODES = { 429 } # in addition to all 5xx status codes
+
+@define
+class AdaptiveLimiter:
+	"""
+	Limits the number of requests in flight and adapts that limit following AIMD (additive increase, multiplicative
+	decrease): each request which completes without signs of congestion raises the limit by 1/limit (i.e. by one per round
+	of requests), while a congested request halves it. A request counts as congested when the server reports that it is
+	busy, responds with a server error, fails with a connection error or takes longer than latency_factor times the usual
+	latency of its api method. The usual latency is a moving average of all samples, so that it follows lasting shifts
+	instead of treating all later requests as congested. Streamed responses are only judged by errors, as their latency is
+	the time to the first byte, which varies with the size of the content.
+	After a decrease, only requests started after the decrease may decrease the limit again, so that a single burst of slow
+	requests does not collapse the limit to its minimum.
+	When min_limit equals max_limit, the limiter behaves like a plain semaphore.
+	"""
+
+	min_limit: int = field( default=DEFAULT_MIN_REQUESTS )
+	max_limit: int = field( default=DEFAULT_MAX_REQUESTS )
+	limit: float = field( default=None ) # current limit, starts at max_limit unless provided
+	latency_factor: float = field( default=3.0 )
+	decrease_factor: float = field( default=0.5 )
+
+	_in_flight: int = field( init=False, default=0 )
+	_ticket: int = field( init=False, default=0 ) # number of requests started so far
+	_decreased_at: int = field( init=False, default=0 ) # ticket of the last request started before the last decrease
+	_latencies: Dict[str, float] = field( init=False, factory=dict ) # moving average of uncongested latencies per key
+	_condition: Condition = field( init=False, factory=Condition )
+
+	def __attrs_post_init__( self ):
+		self.max_limit = max( 1, self.max_limit )
+		self.min_limit = max( 1, min( self.min_limit, self.max_limit ) )
+		self.limit = float( min( max( self.limit or self.max_limit, self.min_limit ), self.max_limit ) )
+
+	@property
+	def in_flight( self ) -> int:
+		return self._in_flight
+
+	def acquire( self ) -> int:
+		"""
+		Blocks until a request may be sent and returns a ticket, which needs to be passed to observe().
+		"""
+		with self._condition:
+			while self._in_flight >= int( self.limit ):
+				self._condition.wait()
+			self._in_flight += 1
+			self._ticket += 1
+			return self._ticket
+
+	def release( self ) -> None:
+		with self._condition:
+			self._in_flight -= 1
+			self._condition.notify_all()
+
+	def observe( self, ticket: int, key: str, latency: Optional[float], status_code: Optional[int] = None, error_code: Optional[int] = None, stream: bool = False ) -> None:
+		"""
+		Adapts the limit based on the outcome of a request. A latency of None denotes a failed request (e.g. connection error).
+		"""
+		with self._condition:
+			failed = latency is None or error_code in BUSY_CODES or status_code in BUSY_STATUS_CODES or ( status_code or 0 ) >= 500
+			average = None if stream else self._latencies.get( key )
+			congested = failed or ( average is not None and latency > self.latency_factor * average )
+			if not failed and not stream:
+				self._latencies[key] = latency if average is None else 0.9 * average + 0.1 * latency
+
+			if congested:
+				if ticket > self._decreased_at:
+					limit, self.limit = self.limit, max( self.min_limit, self.limit * self.decrease_factor )
+					self._decreased_at = self._ticket
+					if int( limit ) != int( self.limit ):
+						log.debug( f'decreased request limit to {int( self.limit )} ({key}: latency={latency}, status={status_code}, code={error_code})' )
+			else:
+				limit, self.limit = self.limit, min( self.max_limit, self.limit + 1 / self.limit )
+				if int( limit ) != int( self.limit ):
+					log.debug( f'increased request limit to {int( self.limit )}' )
+				self._condition.notify_all()
@@ -111,10 +111,10 @@ DOWNLOAD_SHARED_THUMBNAIL = API_THUMBNAIL | GET2 | { 'id': ..., 'type': 'unit',
 BROWSE_ALBUM = { **API_BROWSE_ALBUM, **CAT_NORMAL, **LIST4, }
 BROWSE_ALBUM_ALL = { **API_BROWSE_ALBUM, **SORT_ASC, **CAT_SHARED, **LIST4, }
 BROWSE_FOLDER = API_BROWSE_FOLDER | LIST2 | SORT_ASC | { 'id': 0 }
-BROWSE_ITEM = { 'api': 'SYNO.Foto.Browse.Item', 'sort_by': 'filename', **SORT_ASC, **LIST4, }
+BROWSE_ITEM = { 'api': 'SYNO.Foto.Browse.Item', 'sort_by': 'filename', **SORT_ASC, **LIST4, 'additional': '["thumbnail"]' } # thumbnail info contains the cache key
 
 LIST_ALBUM = API_BROWSE_ALBUM | LIST4 | CAT_SHARED | SORT_ASC | { 'additional': '["sharing_info"]' }
-LIST_SHARED_ITEMS = API_BROWSE_ITEM | LIST4 | SORT_ASC | SORT_TAKENTIME | { 'passphrase': '""' }
+LIST_SHARED_ITEMS = API_BROWSE_ITEM | LIST4 | SORT_ASC | SORT_TAKENTIME | { 'passphrase': '""', 'additional': '["thumbnail"]' }
 
 # search elements
 
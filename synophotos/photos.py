@@ -1,23 +1,34 @@
 from __future__ import annotations
 
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 from logging import getLogger
-from typing import List, Literal, Optional, Tuple
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Literal, Optional, Set, Tuple
 
-from attrs import define, field
+from attrs import define, field, frozen
 from cattrs import Converter
 from cattrs.preconf.json import make_converter
 from more_itertools import first
 
-from synophotos.exif import SynoExif
+from synophotos.exif import SynoExif, exif_map
+from synophotos.index import MetadataIndex, album_items_key, albums_key, folder_items_key, folders_key, root_key
 from synophotos.parameters.photos import *
 from synophotos.parameters.webservice import ENTRY_URL
-from synophotos.webservice import SynoResponse, SynoWebService
+from synophotos.webservice import SynoResponse, SynoWebService, make_structure_fn, register_structure_fn
 
 log = getLogger( __name__ )
 
 ThumbnailSize = Literal['sm', 'm', 'xl', 'compressed', 'original']
 
+CATALOG_TTL = timedelta( minutes=5 )
+
+POPULATE_CHUNK_SIZE = 500 # maximum number of item ids added to an album in one call
+POPULATE_CHUNK_LENGTH = 8192 # maximum length of the encoded item ids of one call
+POPULATE_JOBS = 4 # maximum number of concurrent calls when populating an album
+EXIF_BATCH_SIZE = 100 # maximum number of items to fetch exif data for in one call
+EXIF_BATCH_LENGTH = 2048 # maximum length of the encoded item ids of one call, ids are sent as part of the url
+
 conv = Converter()
 jconv = make_converter()
 
@@ -31,7 +42,7 @@ class Additional:
 	flex_section: List[int] = field( factory=list ) # album only?
 	orientation: int = field( default=None )
 	orientation_original: int = field( default=None )
-	person: List = field( default=list ) # that's of type class???
+	person: List = field( factory=list ) # that's of type class???
 	provider_count: int = field( default=None )
 	provider_user_id: int = field( default=None )
 	rating: int = field( default=None )
@@ -68,6 +79,11 @@ class Item:
 	def indexed( self ) -> datetime:
 		return datetime.utcfromtimestamp( self.indexed_time / 1000 )
 
+	@property
+	def change_token( self ) -> str:
+		# the cache key (<id>_<timestamp>) changes when the server re-indexes an item, even if its size stays the same
+		return f'{self.additional.thumbnail.get( "cache_key" )}|{self.time}|{self.filesize}'
+
 	@classmethod
 	def table_fields( cls ) -> List[str]:
 		return ['id', 'filename', 'filesize', 'folder_id', 'owner_user_id']
@@ -166,11 +182,96 @@ class Permission:
 	def as_str( cls, permissions: List[Permission] ) -> str:
 		return jconv.dumps( permissions )
 
+# fast structuring: most listed items and albums come without additional information, these share a single immutable
+# instance of Additional instead of creating a new one (with six empty containers) per element
+
+class _FrozenDict( dict ):
+
+	def _readonly( self, *args, **kwargs ):
+		raise TypeError( 'empty additional information cannot be modified' )
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+@frozen
+class EmptyAdditional( Additional ):
+	pass
+
+EMPTY_ADDITIONAL = EmptyAdditional( exif=_FrozenDict(), flex_section=(), person=(), resolution=_FrozenDict(), sharing_info=_FrozenDict(), tag=(), thumbnail=_FrozenDict() )
+
+structure_additional = make_structure_fn( Additional )
+register_structure_fn( Item, make_structure_fn( Item, defaults={ 'additional': EMPTY_ADDITIONAL }, hooks={ 'additional': structure_additional } ) )
+register_structure_fn( Album, make_structure_fn( Album, defaults={ 'additional': EMPTY_ADDITIONAL }, hooks={ 'additional': structure_additional } ) )
+register_structure_fn( Folder, make_structure_fn( Folder ) )
+
+# album population
+
+@define
+class PopulationResult:
+
+	added: List[int] = field( factory=list )
+	skipped: List[int] = field( factory=list )
+	failures: List[Tuple[List[int], str]] = field( factory=list )
+
+	def lengths( self ) -> Tuple[int, int, int]:
+		return len( self.added ), len( self.skipped ), sum( len( ids ) for ids, msg in self.failures )
+
+def chunk_items( items: Iterable[Item], size: int = POPULATE_CHUNK_SIZE, length: int = POPULATE_CHUNK_LENGTH ) -> Iterator[List[Item]]:
+	# chunks of at most size items, whose ids encoded as list are not longer than length characters
+	chunk, chunk_length = [], 2
+	for item in items:
+		item_length = len( str( item.id ) ) + 1
+		if chunk and ( len( chunk ) >= size or chunk_length + item_length > length ):
+			yield chunk
+			chunk, chunk_length = [], 2
+		chunk.append( item )
+		chunk_length += item_length
+	if chunk:
+		yield chunk
+
+# album catalog
+
+@define
+class AlbumCatalog:
+	# albums by id (including shared ones), refreshed after ttl or when an unknown id is requested
+
+	ttl: timedelta = field( default=CATALOG_TTL )
+	albums: Dict[int, Album] = field( factory=dict )
+	updated_at: Optional[datetime] = field( default=None )
+
+	_lock: RLock = field( init=False, factory=RLock )
+
+	def is_expired( self ) -> bool:
+		return self.updated_at is None or datetime.utcnow() - self.updated_at > self.ttl
+
+	def update( self, albums: List[Album] ) -> None:
+		with self._lock:
+			self.albums = { a.id: a for a in albums }
+			self.updated_at = datetime.utcnow()
+
+	def add( self, album: Album ) -> None:
+		with self._lock:
+			self.albums[album.id] = album
+
+	def invalidate( self ) -> None:
+		with self._lock:
+			self.updated_at = None
+
+	def get( self, album_id: int, refresh: Callable[[], List[Album]] ) -> Optional[Album]:
+		with self._lock:
+			if self.is_expired() or album_id not in self.albums:
+				self.update( refresh() )
+			return self.albums.get( album_id )
+
 # class for photos
 
 @define
 class SynoPhotos( SynoWebService ):
 
+	catalog: AlbumCatalog = field( factory=AlbumCatalog )
+	index: Optional[MetadataIndex] = field( default=None )
+
+	_exif: Dict[Tuple[int, str], SynoExif] = field( init=False, factory=dict ) # exif data fetched during this run by item id and change token
+
 	# counting elements
 
 	def count_albums( self ) -> int:
@@ -190,72 +291,89 @@ class SynoPhotos( SynoWebService ):
 	# listing elements
 
 	def list_albums( self, *names: str, include_shared: bool = False ) -> List[Album]:
-		payload = BROWSE_ALBUM if not include_shared else BROWSE_ALBUM_ALL
-		albums = self.entry( payload ).as_list( Album )
+		# albums are always fetched (this is a single request), their versions decide whether indexed album items are reused
+		albums = self._fetch_albums( include_shared )
+		if include_shared:
+			self.catalog.update( albums )
 		if names:
 			albums = list( filter( lambda a: any( n for n in names if n.lower() in a.name.lower() ), albums ) )
 		return sorted( albums, key=lambda a: a.name )
 
 	def list_folders( self, parent_id: int = None, name: str = None, recursive: bool = False ) -> List[Folder]:
+		return sorted( self.iter_folders( parent_id, name, recursive ), key=lambda f: f.folder_name )
+
+	def iter_folders( self, parent_id: int = None, name: str = None, recursive: bool = False ) -> Iterator[Folder]:
+		# the tree is traversed level by level, folders of one level are browsed concurrently
+		# the name filter only applies to yielded folders, all subfolders are traversed
 		if parent_id in [None, 0]:
 			parent_id = self.root_folder().id
 
-		folders = []
-		if recursive:
-			root = self.folder( parent_id )
-			queue = [root]
-			while len( queue ) > 0:
-				parent = queue.pop( 0 )
-				children = self.entry( {**BROWSE_FOLDER, 'id': parent.id} ).as_list( Folder )
-				folders.extend( children )
-				queue.extend( children )
-		else:
-			folders = self.get( ENTRY_URL, {**BROWSE_FOLDER, 'id': parent_id} ).as_list( Folder )
-
-		if name:
-			folders = list( filter( lambda f: name.lower() in f.name.lower(), folders ) )
-
-		folders = sorted( folders, key=lambda f: f.folder_name )
-
-		return folders
+		level = [parent_id]
+		while level:
+			parents, level = level, []
+			for children in self.imap( self._browse_folder, parents ):
+				yield from ( c for c in children if not name or name.lower() in c.name.lower() )
+				if recursive:
+					level.extend( c.id for c in children )
 
 	def list_album_items( self, album_id: int = None ) -> List[Item]:
-		items, limit, offset = [], BROWSE_ITEM.get( 'limit' ), BROWSE_ITEM.get( 'offset' )
+		if not album_id:
+			return []
 
-		if album_id:
-			albums = self.list_albums( include_shared=True )
-			album = next( ( a for a in albums if a.id == album_id ), None )
+		album = self.catalog_album( album_id )
 
-			while True:
-				if album.shared and album.passphrase:
-					page = self.entry( {**LIST_SHARED_ITEMS, 'limit': limit, 'offset': offset, 'passphrase': f'"{album.passphrase}"'} ).as_list( Item )
-				else:
-					page = self.entry( {**BROWSE_ITEM, 'album_id': album_id, 'limit': limit, 'offset': offset} ).as_list( Item )
+		# indexed album items are only reused if the album has not changed
+		if self.index and ( items := self.index.listing( album_items_key( album_id ), Item, album.version ) ) is not None and len( items ) == album.item_count:
+			return items
 
-				if page:
-					items.extend( page )
-					offset = offset + limit
-				else:
-					break
+		if album.shared and album.passphrase:
+			# counting does not work with a passphrase, but the album knows how many items it contains
+			payload, count = {**LIST_SHARED_ITEMS, 'passphrase': f'"{album.passphrase}"'}, album.item_count
+		else:
+			payload, count = {**BROWSE_ITEM, 'album_id': album_id}, self.count_items( album_id=album_id )
 
+		items = self._list_pages( [ ( payload, count ) ] )[0]
+		if self.index:
+			self.index.put_listing( album_items_key( album_id ), items, album.version )
 		return items
 
 	def list_folder_items( self, folder_id: int = None, recursive: bool = False ) -> List[Item]:
-		items, limit, offset = [], BROWSE_ITEM.get( 'limit' ), BROWSE_ITEM.get( 'offset' )
-
 		parent_ids = [folder_id]
 		if recursive:
-			parent_ids.extend( [p.id for p in self.list_folders( folder_id, recursive=True )] )
+			parent_ids.extend( [p.id for p in self.iter_folders( folder_id, recursive=True )] )
 
-		for folder_id in parent_ids:
-			while True:
-				if page := self.entry( {**BROWSE_ITEM, 'folder_id': folder_id, 'limit': limit, 'offset': offset} ).as_list( Item ):
-					items.extend( page )
-					offset = offset + limit
-				else:
-					break
+		pages = { fid: self.index.listing( folder_items_key( fid ), Item ) if self.index else None for fid in parent_ids }
+		missing_ids = [ fid for fid, page in pages.items() if page is None ]
 
-		return items
+		counts = self.pmap( lambda fid: self.count_items( folder_id=fid ), missing_ids )
+		fetched = self._list_pages( [ ( {**BROWSE_ITEM, 'folder_id': fid}, count ) for fid, count in zip( missing_ids, counts ) ] )
+		for fid, page in zip( missing_ids, fetched ):
+			pages[fid] = self.index.put_listing( folder_items_key( fid ), page ) if self.index else page
+
+		return [ i for fid in parent_ids for i in pages[fid] ]
+
+	def _list_pages( self, listings: List[Tuple[Dict, int]] ) -> List[List[Item]]:
+		# all pages are fetched concurrently, based on the expected count of each payload; as the count is only a hint,
+		# paging continues sequentially when the last page is full
+		pages = [ ( index, payload, offset ) for index, ( payload, count ) in enumerate( listings ) for offset in range( payload.get( 'offset' ), count or 0, payload.get( 'limit' ) ) ]
+		fetched = self.pmap( lambda p: self.entry( {**p[1], 'offset': p[2]} ).as_list( Item ), pages )
+
+		results = [ [] for _ in listings ]
+		next_offsets = [ payload.get( 'offset' ) for payload, count in listings ]
+		full = [ True for _ in listings ]
+		for ( index, payload, offset ), page in zip( pages, fetched ):
+			results[index].extend( page )
+			next_offsets[index] = offset + payload.get( 'limit' )
+			full[index] = len( page ) == payload.get( 'limit' )
+
+		for index, ( payload, count ) in enumerate( listings ):
+			offset, limit = next_offsets[index], payload.get( 'limit' )
+			while full[index]:
+				page = self.entry( {**payload, 'offset': offset} ).as_list( Item )
+				results[index].extend( page )
+				offset, full[index] = offset + limit, len( page ) == limit
+
+		return results
 
 	def list_items( self, album_id: int = None, folder_id: int = None, recursive: bool = False, name: str = None ) -> List[Item]:
 		if not album_id and not folder_id:
@@ -271,6 +389,63 @@ class SynoPhotos( SynoWebService ):
 		items = list( filter( lambda i: name.lower() in i.filename.lower(), items ) ) if name else items
 		return items
 
+	# iterating over elements: contrary to the list_* methods, items are yielded page by page as they arrive
+
+	def iter_items( self, album_id: int = None, folder_id: int = None, recursive: bool = False, name: str = None ) -> Iterator[Item]:
+		if not album_id and not folder_id:
+			folder_id = self.root_folder().id
+
+		if album_id:
+			items = self.iter_album_items( album_id )
+		else:
+			items = self.iter_folder_items( folder_id, recursive )
+
+		yield from ( i for i in items if name.lower() in i.filename.lower() ) if name else items
+
+	def iter_album_items( self, album_id: int ) -> Iterator[Item]:
+		album = self.catalog_album( album_id )
+		if album.shared and album.passphrase:
+			payload = {**LIST_SHARED_ITEMS, 'passphrase': f'"{album.passphrase}"'}
+		else:
+			payload = {**BROWSE_ITEM, 'album_id': album_id}
+		yield from self._iter_listing( album_items_key( album_id ), payload, album.version, album.item_count )
+
+	def iter_folder_items( self, folder_id: int, recursive: bool = False ) -> Iterator[Item]:
+		yield from self._iter_listing( folder_items_key( folder_id ), {**BROWSE_ITEM, 'folder_id': folder_id} )
+		if recursive:
+			for folder in self.iter_folders( folder_id, recursive=True ):
+				yield from self._iter_listing( folder_items_key( folder.id ), {**BROWSE_ITEM, 'folder_id': folder.id} )
+
+	def _iter_listing( self, key: str, payload: Dict, version: Optional[int] = None, count: Optional[int] = None ) -> Iterator[Item]:
+		# fetched pages are stored in the index, the listing itself is only recorded after a complete iteration
+		if self.index and ( items := self.index.listing( key, Item, version ) ) is not None and ( count is None or len( items ) == count ):
+			yield from items
+			return
+
+		ids = []
+		for page in self._iter_pages( payload ):
+			if self.index:
+				self.index.put_elements( page )
+				ids.extend( i.id for i in page )
+			yield from page
+
+		if self.index:
+			self.index.put_ids( key, ids, version )
+
+	def _iter_pages( self, payload: Dict ) -> Iterator[List[Item]]:
+		# the next page is requested while the current one is consumed, so at most two pages are held in memory
+		offset, limit = payload.get( 'offset' ), payload.get( 'limit' )
+		fetch = lambda o: self.entry( {**payload, 'offset': o} ).as_list( Item )
+
+		with ThreadPoolExecutor( max_workers=1 ) as executor:
+			future = executor.submit( fetch, offset )
+			while future:
+				page, future = future.result(), None
+				if len( page ) == limit:
+					offset += limit
+					future = executor.submit( fetch, offset )
+				yield page
+
 	def list_groups( self ):
 		response = self.get( ENTRY_URL, LIST_USER_GROUP ).data.get( 'list' )
 		response = [e for e in response if e.get( 'type' ) == 'group']
@@ -289,7 +464,9 @@ class SynoPhotos( SynoWebService ):
 	# create functionality
 
 	def create_album( self, name: str ) -> Album:
-		return self.get( ENTRY_URL, {**CREATE_ALBUM, 'name': name} ).as_obj( Album )
+		album = self.get( ENTRY_URL, {**CREATE_ALBUM, 'name': name} ).as_obj( Album )
+		self.catalog.add( album )
+		return album
 
 	def create_folder( self, name: str, parent_id: int = 0 ) -> int:
 		return self.get( ENTRY_URL, {**CREATE_FOLDER, 'name': f'\"{name}\"', 'target_id': parent_id} )
@@ -297,34 +474,68 @@ class SynoPhotos( SynoWebService ):
 	def exif( self, item_id: int ) -> SynoExif:
 		return SynoExif( response=self.entry( GET_EXIF, id=f'[{item_id}]' ) )
 
-	def download( self, item_id: int, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, include_exif = False ) -> Tuple[Item, bytes]:
-		_item, binary = self.item( item_id, passphrase ), b''
-		if thumbnail in ['sm', 'm', 'xl'] :
-			response = self.entry( DOWNLOAD_THUMBNAIL, id=item_id, cache_key=_item.additional.thumbnail.get( 'cache_key' ), passphrase=passphrase )
-		elif thumbnail == 'compressed':
-			response = self.entry( DOWNLOAD_COMPRESSED, item_id=f'[{item_id}]', passphrase=passphrase )
-		else:
-			response = self.entry( DOWNLOAD_ORIGINAL, item_id=f'[{item_id}]', passphrase=passphrase )
+	def list_exif( self, items: Iterable[Item], batch_size: int = EXIF_BATCH_SIZE ) -> Dict[int, SynoExif]:
+		# exif data is kept by change token for this run and in the index (if enabled), items without exif data are missing
+		items = { i.id: i for i in items }
+		exifs = { id: exif for id, i in items.items() if ( exif := self._exif.get( ( id, i.change_token ) ) ) }
+		if self.index:
+			exifs |= { id: SynoExif( data=data ) for id, data in self.index.exif( { id: i.change_token for id, i in items.items() if id not in exifs } ).items() }
 
-		binary = response.as_bytes()
+		fetched = {}
+		chunks = chunk_items( [ i for id, i in items.items() if id not in exifs ], batch_size, EXIF_BATCH_LENGTH )
+		for batch in self.imap( lambda chunk: exif_map( self.entry( GET_EXIF, id=f'[{",".join( str( i.id ) for i in chunk )}]' ) ), chunks ):
+			fetched.update( { id: exif for id, exif in batch.items() if id in items } )
+		if self.index:
+			self.index.put_exif( { id: ( items[id].change_token, exif.data ) for id, exif in fetched.items() } )
+		self._exif |= { ( id, items[id].change_token ): exif for id, exif in ( exifs | fetched ).items() }
+
+		log.debug( f'fetched exif data of {len( fetched )} items, {len( exifs )} items have been taken from memory or the index' )
+		return exifs | fetched
+
+	def download( self, item_id: int, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, include_exif = False ) -> Tuple[Item, bytes]:
+		_item = self.item( item_id, passphrase )
+		binary = self._download( _item, passphrase, thumbnail ).as_bytes()
 
 		if include_exif:
-			binary = self.exif( item_id ).apply( binary, _item )
+			binary = self.list_exif( [ _item ] ).get( _item.id, SynoExif() ).apply( binary, _item )
 
 		log.info( f'downloaded item {_item.filename} (id {_item.id}, {_item.filesize} bytes)' )
 
 		return _item, binary
 
+	def stream( self, item: Item, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, offset: int = 0 ) -> SynoResponse:
+		# content is not read into memory; servers might ignore the range request for offset and respond with 200 instead of 206
+		if thumbnail in ['sm', 'm', 'xl'] and not item.additional.thumbnail.get( 'cache_key' ):
+			item = self.item( item.id, passphrase )
+		return self._download( item, passphrase, thumbnail, stream=True, headers={ 'Range': f'bytes={offset}-' } if offset else None )
+
+	def stream_batch( self, items: List[Item], thumbnail: Optional[ThumbnailSize] = 'compressed' ) -> SynoResponse:
+		# the server responds with a zip archive, this does not work for items needing a passphrase and for thumbnails
+		if thumbnail in ['sm', 'm', 'xl']:
+			raise ValueError( f'batch downloads are not supported for thumbnails of size {thumbnail}' )
+		item_ids = f'[{",".join( str( i.id ) for i in items )}]'
+		return self.entry( DOWNLOAD_COMPRESSED if thumbnail == 'compressed' else DOWNLOAD_ORIGINAL, stream=True, item_id=item_ids )
+
+	def _download( self, item: Item, passphrase: str = None, thumbnail: Optional[ThumbnailSize] = None, stream: bool = False, headers: Optional[Dict] = None ) -> SynoResponse:
+		if thumbnail in ['sm', 'm', 'xl'] :
+			return self.entry( DOWNLOAD_THUMBNAIL, stream=stream, headers=headers, id=item.id, cache_key=item.additional.thumbnail.get( 'cache_key' ), passphrase=passphrase )
+		elif thumbnail == 'compressed':
+			return self.entry( DOWNLOAD_COMPRESSED, stream=stream, headers=headers, item_id=f'[{item.id}]', passphrase=passphrase )
+		else:
+			return self.entry( DOWNLOAD_ORIGINAL, stream=stream, headers=headers, item_id=f'[{item.id}]', passphrase=passphrase )
+
 	# helpers
 
 	def album( self, id: int ) -> Album:
 		album = first( self.entry( GET_ALBUM, id=f'[{id}]' ).as_obj( List[Album] ), None )
 		if not album: # no album, try again with shared albums
-			albums = self.list_albums( include_shared=True )
-			if album := first( [a for a in albums if id == a.id], None ):
+			if album := self.catalog_album( id ):
 				album = first( self.entry( GET_SHARED_ALBUM, passphrase=album.passphrase ).as_obj( List[Album] ) )
 		return album
 
+	def catalog_album( self, id: int ) -> Optional[Album]:
+		return self.catalog.get( id, lambda: self._fetch_albums( include_shared=True ) )
+
 	def albums( self, *names: str, include_shared=False ) -> List[Album]:
 		return self.list_albums( *names, include_shared=include_shared )
 
@@ -341,12 +552,73 @@ class SynoPhotos( SynoWebService ):
 			return first( self.entry( GET_ITEM, id=f'[{id}]' ).as_obj( List[Item] ), None )
 
 	def root_folder( self ) -> Folder:
-		return self.folder( 0 )
-
-	def add_album_items( self, album: Album, items: List[Item] ) -> None:
+		if self.index and ( root := self.index.listing( root_key(), Folder ) ):
+			return root[0]
+		root = self.folder( 0 )
+		if self.index:
+			self.index.put_listing( root_key(), [root] )
+		return root
+
+	def _fetch_albums( self, include_shared: bool = False ) -> List[Album]:
+		albums = self.entry( BROWSE_ALBUM if not include_shared else BROWSE_ALBUM_ALL ).as_list( Album )
+		return self.index.put_listing( albums_key( include_shared ), albums ) if self.index else albums
+
+	def _browse_folder( self, parent_id: int ) -> List[Folder]:
+		if self.index and ( folders := self.index.listing( folders_key( parent_id ), Folder ) ) is not None:
+			return folders
+		folders = self.entry( {**BROWSE_FOLDER, 'id': parent_id} ).as_list( Folder )
+		return self.index.put_listing( folders_key( parent_id ), folders ) if self.index else folders
+
+	def add_album_items( self, album: Album, items: List[Item] ) -> SynoResponse:
 		item_ids = [str( i.id ) for i in items]
 		item_ids_str = f'[{",".join( item_ids )}]'
-		self.get( ENTRY_URL, {**ADD_ITEM_TO_ALBUM, 'id': album.id, 'item': item_ids_str} )
+		response = self.post( ENTRY_URL, {**ADD_ITEM_TO_ALBUM, 'id': album.id, 'item': item_ids_str} )
+		# item count and version of the album have changed
+		self.catalog.invalidate()
+		if self.index:
+			self.index.remove_listing( album_items_key( album.id ) )
+		return response
+
+	def populate_album( self, album: Album, items: Iterable[Item], jobs: int = POPULATE_JOBS, progress: Optional[Callable[[int], None]] = None ) -> PopulationResult:
+		# chunks are sent concurrently while items are still consumed, items already contained in the album are skipped,
+		# so populating an album can be repeated after a failure
+		result = PopulationResult()
+		progress = progress or ( lambda count: None )
+		existing = { i.id for i in self.iter_album_items( album.id ) }
+
+		def pending_items() -> Iterator[Item]:
+			for i in items:
+				if i.id in existing:
+					result.skipped.append( i.id )
+					progress( 1 )
+				else:
+					yield i
+
+		def collect( done: Set[Future] ) -> None:
+			for future in done:
+				ids = [ i.id for i in futures.pop( future ) ]
+				try:
+					if ( response := future.result() ).success:
+						result.added.extend( ids )
+					else:
+						result.failures.append( ( ids, f'code={response.error_code}, msg={response.error_msg}' ) )
+				except Exception as e:
+					result.failures.append( ( ids, str( e ) ) )
+				progress( len( ids ) )
+
+		futures = {}
+		with ThreadPoolExecutor( max_workers=max( 1, jobs ), thread_name_prefix='populate' ) as executor:
+			for chunk in chunk_items( pending_items() ):
+				futures[executor.submit( self.add_album_items, album, chunk )] = chunk
+				if len( futures ) >= 2 * jobs: # bound the number of queued chunks
+					collect( wait( futures.keys(), return_when=FIRST_COMPLETED ).done )
+			collect( wait( futures.keys() ).done )
+
+		for ids, msg in result.failures:
+			log.error( f'failed to add {len( ids )} items to album {album.id}: {msg}' )
+		log.info( f'populated album {album.id} (added/skipped/failed): {result.lengths()}' )
+
+		return result
 
 	def id_for_user( self, user: str ) -> int:
 		return next( (d.get( 'id' ) for d in self.list_users() if (d.get( 'name' ) == user and d.get( 'type' ) == 'user')), None )
@@ -368,6 +640,7 @@ class SynoPhotos( SynoWebService ):
 			return
 
 		response = self.entry( SHARE_ALBUM, album_id=album_id, enabled='true' )
+		self.catalog.invalidate() # sharing state and passphrase have changed
 
 		if public:
 			permissions = [Permission( role=role, member=Member( type='public' ) )]
@@ -385,12 +658,13 @@ class SynoPhotos( SynoWebService ):
 		folder = self.folder( folder_id )
 		album_name = album_name if album_name else folder.name.split( '/' )[-1]
 		album = self.create_album( album_name )
-		self.add_album_items( album, self.list_items( folder_id, True, False ) )
+		self.populate_album( album, self.iter_folder_items( folder_id ) )
 		return self.share_album( album.id, role, public, user_id, group_id )
 
 	def grant_permission( self, permissions: List[Permission], passphrase: str ) -> SynoResponse:
 		return self.entry( UPDATE_PERMISSION, permission=Permission.as_str( permissions ), passphrase=f'"{passphrase}"' )
 
 	def unshare_album( self, album_id: int ) -> SynoResponse:
+		self.catalog.invalidate()
 		return self.entry( SHARE_ALBUM, album_id=album_id, enabled='false' )
 
@@ -0,0 +1,86 @@
+from collections import Counter
+from math import ceil
+from threading import Lock
+from typing import Dict, List, Optional, Union
+
+from attrs import define, field
+
+PERCENTILES = [ 50, 90, 99 ]
+
+@define
+class ApiStats:
+	"""
+	Counters for all requests to one api method.
+	"""
+
+	api: str = field( default=None )
+	method: str = field( default=None )
+	count: int = field( default=0 )
+	errors: Counter = field( factory=Counter ) # error code (or exception type of failed calls) -> number of occurrences
+	bytes_in: int = field( default=0 )
+	bytes_out: int = field( default=0 )
+	latencies: List[float] = field( factory=list ) # seconds per request
+
+	@property
+	def name( self ) -> str:
+		return f'{self.api}.{self.method}'
+
+	@property
+	def total_time( self ) -> float:
+		return sum( self.latencies )
+
+	def percentile( self, p: float ) -> float:
+		# nearest-rank percentile
+		if not self.latencies:
+			return 0.0
+		latencies = sorted( self.latencies )
+		return latencies[max( 0, ceil( p / 100 * len( latencies ) ) - 1 )]
+
+	def as_dict( self ) -> Dict:
+		return {
+			'api': self.api,
+			'method': self.method,
+			'count': self.count,
+			'errors': dict( self.errors ),
+			'bytes_in': self.bytes_in,
+			'bytes_out': self.bytes_out,
+			'total_time': self.total_time,
+			**{ f'p{p}': self.percentile( p ) for p in PERCENTILES },
+		}
+
+@define
+class RequestStats:
+	"""
+	Thread-safe collection of request statistics, grouped by api and method.
+	"""
+
+	apis: Dict[str, ApiStats] = field( factory=dict )
+
+	_lock: Lock = field( init=False, factory=Lock )
+
+	def record( self, api: Optional[str], method: Optional[str], seconds: float, bytes_out: int = 0, bytes_in: int = 0, error_code: Optional[Union[int, str]] = None ) -> None:
+		with self._lock:
+			stats = self.apis.get( key := f'{api}.{method}' )
+			if stats is None:
+				stats = self.apis[key] = ApiStats( api=api, method=method )
+			stats.count += 1
+			stats.bytes_out += bytes_out
+			stats.bytes_in += bytes_in
+			stats.latencies.append( seconds )
+			if error_code is not None:
+				stats.errors[error_code] += 1
+
+	def reset( self ) -> None:
+		with self._lock:
+			self.apis = {}
+
+	@property
+	def count( self ) -> int:
+		return sum( s.count for s in self.apis.values() )
+
+	def summary( self ) -> List[Dict]:
+		"""
+		Returns the statistics of all api methods as list of dicts, ordered by total time spent.
+		"""
+		with self._lock:
+			return [ s.as_dict() for s in sorted( self.apis.values(), key=lambda s: s.total_time, reverse=True ) ]
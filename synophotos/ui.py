@@ -1,28 +1,35 @@
+from __future__ import annotations
+
 from dataclasses import fields
-from typing import Any, List, Optional, Type
+from functools import cache
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Type
 
 from attrs import fields
 from attrs.exceptions import NotAnAttrsClassError
+from more_itertools import chunked
 
-from rich import box
-from rich.console import Console
-from rich.pretty import Pretty, pretty_repr
-from rich.prompt import Confirm
-from rich.style import Style
-from rich.table import Table
+if TYPE_CHECKING:
+	from rich.console import Console
+	from rich.progress import Progress
+	from rich.table import Table
 
-cs = Console()
+blue = 'blue' # header style of tables
 
-blue = Style( color='blue' )
+@cache
+def console() -> Console:
+	# rich is only imported when something is printed for the first time
+	from rich.console import Console
+	return Console()
 
 def confirm( msg: str, force: bool = False ) -> bool:
+	from rich.prompt import Confirm
 	return force or Confirm().ask( msg )
 
 def pprint( item: Any ):
-	cs.print( item )
+	console().print( item )
 
 def print_obj_table( obj: Any ):
-	cs.print( obj_table( obj ) )
+	console().print( obj_table( obj ) )
 
 def print_obj( obj: Any ) -> None:
 		if isinstance( obj, list ):
@@ -30,13 +37,42 @@ def print_obj( obj: Any ) -> None:
 		else:
 			pprint( obj )
 
+def print_iter( instances: Iterable, cls: Type = None, chunk_size: int = 100 ) -> None:
+	# print one table per chunk as soon as the chunk is available, the header is printed with the first chunk only and
+	# the column widths of the first chunk are kept for all following chunks, so that columns stay aligned
+	widths = None
+	for chunk in chunked( instances, chunk_size ):
+		show_header = widths is None
+		widths = widths or _column_widths( dataclass_table( chunk, cls ) )
+		pprint( dataclass_table( chunk, cls, show_header=show_header, widths=widths ) )
+	if widths is None:
+		pprint( dataclass_table( [], cls ) )
+
+def progress_bar() -> Progress:
+	from rich.progress import Progress
+	return Progress( console=console(), transient=True )
+
+def print_stats( summary: List[Dict] ) -> None:
+	cols = [ 'api', 'method', 'requests', 'errors', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'total (s)', 'sent', 'received' ]
+	rows = [ [
+		s['api'], s['method'], s['count'], ', '.join( f'{code}: {count}' for code, count in s['errors'].items() ) or '-',
+		round( s['p50'] * 1000, 1 ), round( s['p90'] * 1000, 1 ), round( s['p99'] * 1000, 1 ), round( s['total_time'], 2 ),
+		s['bytes_out'], s['bytes_in'],
+	] for s in summary ]
+	table = _table()
+	[ table.add_column( c, header_style=blue, justify='left' if c in [ 'api', 'method', 'errors' ] else 'right' ) for c in cols ]
+	for row in rows:
+		table.add_row( *[ str( v ) for v in row ] )
+	pprint( table )
+
 def print_error( msg: str ):
-	cs.print( f'[red]Error:[/red] {msg}' )
+	console().print( f'[red]Error:[/red] {msg}' )
 
 #
 
 def obj_table( obj: Any ) -> Table:
-	table = Table( box=box.MINIMAL, show_header=True, show_footer=False )
+	from rich.pretty import Pretty
+	table = _table()
 	[ table.add_column( c, header_style=blue ) for c in ['attribute', 'value'] ]
 
 	try:
@@ -55,14 +91,15 @@ def obj_table( obj: Any ) -> Table:
 	return table
 
 def table_for( cols: List, rows: List[List] ) -> Table:
-	table = Table( box=box.MINIMAL, show_header=True, show_footer=False )
+	from rich.pretty import Pretty
+	table = _table()
 	[ table.add_column( c, header_style=blue ) for c in cols ]
 	for row in rows:
 		table.add_row( *[Pretty( r ) for r in row] )
 		# table.add_row( *[pretty_repr( r ) for r in row] )
 	return table
 
-def dataclass_table( instances: List, cls: Type = None ) -> Optional[Table]:
+def dataclass_table( instances: List, cls: Type = None, show_header: bool = True, widths: Optional[List[int]] = None ) -> Optional[Table]:
 	# determine fields to display
 
 	try:
@@ -95,12 +132,24 @@ def dataclass_table( instances: List, cls: Type = None ) -> Optional[Table]:
 
 	# create table
 
-	table = Table( box=box.MINIMAL, show_header=True, show_footer=False )
+	from rich.pretty import Pretty
+	table = _table( show_header )
 
-	for f in table_fields:
-		table.add_column( f, header_style=blue )
+	for index, f in enumerate( table_fields ):
+		table.add_column( f, header_style=blue, width=widths[index] if widths else None )
 
 	for row in rows:
 		table.add_row( *[Pretty( v ) for v in row] )
 
 	return table
+
+def _column_widths( table: Table ) -> List[int]:
+	# widths of the columns of a table as rendered on the console, without padding
+	from rich.measure import Measurement
+	options = console().options
+	return [ max( Measurement.get( console(), options, cell ).maximum for cell in [ c.header, *c.cells ] ) for c in table.columns ]
+
+def _table( show_header: bool = True ) -> Table:
+	from rich import box
+	from rich.table import Table
+	return Table( box=box.MINIMAL, show_header=show_header, show_footer=False )
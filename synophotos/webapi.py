@@ -1,6 +1,5 @@
 
 from typing import Dict
-from requests import get
 from synophotos.webservice import SynoWebService
 
 # urls
@@ -19,4 +18,4 @@ ENTRY_PARAMS = {
 class SynoWebApi( SynoWebService ):
 
     def info( self ) -> Dict:
-        return get(self.get_url(ENTRY_URL), ENTRY_PARAMS, verify=True).json()
+        return self.transport.get( self.get_url( ENTRY_URL ), ENTRY_PARAMS ).json()
@@ -1,28 +1,46 @@
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from logging import getLogger
+from logging import DEBUG, getLogger
 from sys import exit as sysexit
-from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Type, TypeVar
 
-from attrs import define, field
+from attrs import NOTHING, Factory, define, field, fields
 from cattrs import Converter
-from requests import JSONDecodeError, PreparedRequest, Response, get, post
-from rich.pretty import pretty_repr
-from rich.prompt import Prompt
 from typing_extensions import Protocol
 
+# requests and rich are imported on demand, as they are expensive to import and not needed by all commands
+if TYPE_CHECKING:
+	from requests import PreparedRequest, Response, Session
+
+try:
+	from orjson import loads as json_loads # optional, faster json backend
+except ImportError:
+	from json import loads as json_loads
+
 from synophotos import Cache
-from synophotos.error_codes import CODE_SUCCESS, CODE_UNKNOWN, error_codes
+from synophotos.error_codes import CODE_SUCCESS, CODE_UNKNOWN, SESSION_CODES, error_codes
+from synophotos.limiter import AdaptiveLimiter
 from synophotos.parameters.photos import SID
 from synophotos.parameters.webservice import ENTRY_URL, LOGIN_PARAMS
+from synophotos.stats import RequestStats
 from synophotos.ui import print_error
 
 log = getLogger( __name__ )
 
 T = TypeVar( 'T' )
+R = TypeVar( 'R' )
 SESSION_TIMEOUT = timedelta( days=30 )
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 1024 * 1024
 conv = Converter()
 
+# pre-generated structure functions for frequently decoded classes, see make_structure_fn()
+STRUCTURE_FNS: Dict[Type, Callable[[Dict], Any]] = {}
+
 class WebService( Protocol ):
 
 	@property
@@ -44,36 +62,88 @@ class SynoRequest:
 @define
 class SynoResponse:
 
-	response: Response = field( default=None )
+	response: 'Response' = field( default=None )
 	status_code: int = field( default=None )
 	data: Dict = field( factory=dict )
 	success: bool = field( default=False )
 	error_code: int = field( default=None )
 	error_msg: str = field( default=None )
+	stream: bool = field( default=False )
+	payload: Optional[Dict] = field( default=None ) # decoded json body, None for binary responses
+	release: Optional[Callable[[], None]] = field( default=None ) # called once the response has been consumed or closed
 
 	# noinspection PyTestUnpassedFixture
 	def __attrs_post_init__( self ):
 		self.status_code = self.response.status_code
-		try:
-			json = self.response.json()
-			self.success = json.get( 'success', False )
-			if self.success:
-				self.data = json.get( 'data', {} )
-				self.error_code = CODE_SUCCESS
-				self.error_msg = error_codes.get( CODE_SUCCESS )
-			else:
-				self.error_code = json.get( 'error' ).get( 'code' )
-				self.error_msg = error_codes.get( self.error_code, error_codes.get( CODE_UNKNOWN ) )
-		except JSONDecodeError:
+		if self.payload is None:
+			self.payload = self.decode()
+
+		if self.payload is not None:
+			self.parse( self.payload )
+		else:
 			self.success = True if self.status_code in range( 200, 300 ) else False
 
+	def decode( self ) -> Optional[Dict]:
+		# do not touch the body of streamed binary responses, this would load the whole content into memory
+		if self.stream and not self.is_json():
+			return None
+
+		# only attempt to decode bodies which look like json, binary content might be large
+		content = self.response.content
+		if self.is_json() or content.lstrip()[:1] in [ b'{', b'[' ]:
+			try:
+				return json_loads( content )
+			except ValueError:
+				pass
+		return None
+
+	def parse( self, json: Dict ) -> None:
+		self.success = json.get( 'success', False )
+		if self.success:
+			self.data = json.get( 'data', {} )
+			self.error_code = CODE_SUCCESS
+			self.error_msg = error_codes.get( CODE_SUCCESS )
+		else:
+			self.error_code = json.get( 'error' ).get( 'code' )
+			self.error_msg = error_codes.get( self.error_code, error_codes.get( CODE_UNKNOWN ) )
+
 	def as_bytes( self ) -> bytes:
-		return self.response.content
+		try:
+			return self.response.content
+		finally:
+			self._release()
+
+	def iter_bytes( self, chunk_size: int = DEFAULT_CHUNK_SIZE ) -> Iterator[bytes]:
+		try:
+			yield from self.response.iter_content( chunk_size=chunk_size )
+		finally:
+			self.close()
+
+	def close( self ) -> None:
+		self.response.close()
+		self._release()
+
+	def __enter__( self ) -> 'SynoResponse':
+		return self
+
+	def __exit__( self, *args ) -> None:
+		self.close()
+
+	def _release( self ) -> None:
+		if self.release is not None:
+			release, self.release = self.release, None
+			release()
+
+	def is_json( self ) -> bool:
+		return 'json' in self.response.headers.get( 'Content-Type', '' )
 
 	def as_text( self ) -> str:
 		return self.response.text
 
 	def as_list( self, cls: Type[T] ) -> List[T]:
+		# fast path: elements are structured in the order of the server, without going through the generic converter
+		if fn := STRUCTURE_FNS.get( cls ):
+			return [ fn( e ) for e in self.data.get( 'list' ) or [] ]
 		return [conv.structure( e, cls ) for e in self.as_dict_list()]
 
 	def as_dict_list( self ) -> List[Dict]:
@@ -92,12 +162,53 @@ class SynoResponse:
 		# else:
 		#	  return conv.structure( value, cls )
 
-	def request( self ) -> PreparedRequest:
+	def request( self ) -> 'PreparedRequest':
 		return self.response.request
 
 	def response_data( self, key: str ) -> Any:
 		return self.data.get( key, None )
 
+# structuring
+
+def make_structure_fn( cls: Type[T], defaults: Optional[Dict[str, Any]] = None, hooks: Optional[Dict[str, Callable]] = None ) -> Callable[[Dict], T]:
+	"""
+	Generates a function which creates an instance of the attrs class cls from a dict by passing all values positionally.
+	Contrary to the generic converter, values are taken as they are (no type conversion takes place) and unknown keys are ignored.
+	Missing or None values are replaced by the attribute default or, if provided, by the value from defaults. Hooks are applied
+	to present values only, which allows structuring nested classes.
+	"""
+	defaults, hooks = defaults or {}, hooks or {}
+	args, globs = [], { '_cls': cls }
+	for i, a in enumerate( a for a in fields( cls ) if a.init ):
+		value = f'_h{i}( v ) if ( v := d.get( {a.name!r} ) ) is not None' if a.name in hooks else f'v if ( v := d.get( {a.name!r} ) ) is not None'
+		if a.name in hooks:
+			globs[f'_h{i}'] = hooks[a.name]
+		if a.name in defaults:
+			globs[f'_d{i}'] = defaults[a.name]
+			args.append( f'{value} else _d{i}' )
+		elif isinstance( a.default, Factory ):
+			globs[f'_d{i}'] = a.default.factory
+			args.append( f'{value} else _d{i}()' )
+		elif a.default is not NOTHING:
+			globs[f'_d{i}'] = a.default
+			args.append( f'{value} else _d{i}' )
+		else:
+			args.append( f'd[{a.name!r}]' )
+
+	source = f'def structure_{cls.__name__}( d ):\n\treturn _cls( {", ".join( args )} )\n'
+	exec( compile( source, f'<structure {cls.__qualname__}>', 'exec' ), globs )
+	return globs[f'structure_{cls.__name__}']
+
+def request_size( request: 'PreparedRequest' ) -> int:
+	body = request.body or b''
+	return len( request.url ) + len( body if isinstance( body, bytes ) else body.encode( 'utf-8' ) )
+
+def register_structure_fn( cls: Type[T], fn: Callable[[Dict], T] ) -> None:
+	STRUCTURE_FNS[cls] = fn
+
+def structure( data: Dict, cls: Type[T] ) -> T:
+	return fn( data ) if ( fn := STRUCTURE_FNS.get( cls ) ) else conv.structure( data, cls )
+
 @define
 class SynoSession:
 
@@ -123,6 +234,45 @@ class SynoSession:
 				return True
 		return False
 
+@define
+class SynoTransport:
+	"""
+	Pooled HTTP transport: keeps a set of keep-alive connections to the server, so that subsequent requests
+	do not need to go through TCP connect and TLS handshake again.
+	"""
+
+	pool_size: int = field( default=DEFAULT_POOL_SIZE )
+	verify: bool = field( default=True )
+
+	http: 'Session' = field( init=False, default=None )
+
+	def __attrs_post_init__( self ):
+		from requests import Session
+		self.http = Session()
+		self._mount()
+
+	def resize( self, pool_size: int ) -> None:
+		# remounting drops idle connections of the old adapters, so only do this when the size really changes
+		if pool_size != self.pool_size:
+			self.pool_size = pool_size
+			self._mount()
+
+	def _mount( self ) -> None:
+		from requests.adapters import HTTPAdapter
+		for prefix in [ 'https://', 'http://' ]:
+			self.http.mount( prefix, HTTPAdapter( pool_connections=1, pool_maxsize=self.pool_size ) )
+		log.debug( f'using transport with connection pool size {self.pool_size}' )
+
+	def get( self, url: str, params: Dict, **kwargs ) -> 'Response':
+		return self.http.get( url=url, params=params, verify=self.verify, **kwargs )
+
+	def post( self, url: str, params: Dict, **kwargs ) -> 'Response':
+		# parameters of post requests are sent as form body, which is not subject to the length limits of urls
+		return self.http.post( url=url, data=params, verify=self.verify, **kwargs )
+
+	def close( self ) -> None:
+		self.http.close()
+
 @define
 class SynoWebService:
 	url: str = field( default=None )
@@ -132,6 +282,22 @@ class SynoWebService:
 	session: SynoSession = field( default=None )
 	cache: Cache = field( default=None )
 
+	pool_size: int = field( default=DEFAULT_POOL_SIZE )
+	concurrency: int = field( default=DEFAULT_CONCURRENCY )
+	transport: SynoTransport = field( default=None )
+	limiter: AdaptiveLimiter = field( default=None )
+	stats: RequestStats = field( factory=RequestStats )
+
+	on_session: Optional[Callable[[Optional[SynoSession]], None]] = field( default=None ) # called whenever a new session has been created, or with None when it has been dropped
+	_session_lock: Lock = field( init=False, factory=Lock )
+
+	def __attrs_post_init__( self ):
+		if self.limiter is None:
+			self.limiter = AdaptiveLimiter( max_limit=self.pool_size, limit=self.concurrency )
+		if self.transport is None:
+			# more connections than requests in flight would never be used
+			self.transport = SynoTransport( pool_size=max( self.pool_size, self.limiter.max_limit ) )
+
 	@property
 	def session_id( self ) -> Optional[str]:
 		return self.session.sid if self.session else None
@@ -144,41 +310,96 @@ class SynoWebService:
 		self.cache = cache if cache else Cache()
 		self.cache.enabled = True
 
-	def entry( self, payload: Dict, **kwargs ) -> SynoResponse:
-		return self.get( ENTRY_URL, payload, **kwargs )
+	def entry( self, payload: Dict, stream: bool = False, headers: Optional[Dict] = None, **kwargs ) -> SynoResponse:
+		return self.get( ENTRY_URL, payload, stream=stream, headers=headers, **kwargs )
+
+	def req( self, fn: Callable, url: str, template: Dict, stream: bool = False, headers: Optional[Dict] = None, **kwargs ) -> SynoResponse:
+		sid = self.session_id
+		syno_response = self._req( fn, url, template, sid, stream, headers, **kwargs )
+		# the server rejects the session id (e.g. after a timeout or a login from elsewhere): log in again and retry once
+		if sid and syno_response.error_code in SESSION_CODES and self.renew_session( sid ):
+			syno_response.close()
+			syno_response = self._req( fn, url, template, self.session_id, stream, headers, **kwargs )
+		return syno_response
 
-	def req( self, fn: Callable, url: str, template: Dict, **kwargs ) -> SynoResponse:
+	def _req( self, fn: Callable, url: str, template: Dict, sid: Optional[str], stream: bool = False, headers: Optional[Dict] = None, **kwargs ) -> SynoResponse:
 		url = self.get_url( url )
-		if self.session_id:
-			template = template | SID | { '_sid': self.session_id }
+		if sid:
+			template = template | SID | { '_sid': sid }
 
 		params = template | kwargs  # create variable making debugging easier
 		params = { k: v for k, v in params.items() if v is not None } # throw away all None values
 
-		log.debug( f'[dark_orange]{fn.__name__.upper()}[/dark_orange] {url}' )
-		log.debug( f'[dark_orange]Parameters:[/dark_orange] {pretty_repr( params )}' )
+		# check the log level first, so that payload dumps are only created when they are actually printed
+		debug = log.isEnabledFor( DEBUG )
+		if debug:
+			from rich.pretty import pretty_repr
+			log.debug( f'[dark_orange]{fn.__name__.upper()}[/dark_orange] {url}' )
+			log.debug( f'[dark_orange]Parameters:[/dark_orange] {pretty_repr( params )}' )
 
-		response: Response = fn( url=url, params=params, verify=True )
-
-		log.debug( f'[dark_orange]Response:[/dark_orange] {response.status_code}' )
+		key = f'{params.get( "api" )}.{params.get( "method" )}'
+		ticket = self.limiter.acquire()
+		start = perf_counter()
 		try:
-			log.debug( f'[dark_orange]Payload:[/dark_orange] {pretty_repr( response.json(), max_depth=6 )}' )
-		except JSONDecodeError:
-			log.debug( f'[dark_orange]Payload:[/dark_orange] <binary> length={len( response.content )}' )
+			response: 'Response' = fn( url=url, params=params, stream=stream, headers=headers )
+			syno_response = SynoResponse( response=response, stream=stream )
+		except Exception as e:
+			self.limiter.observe( ticket, key, None )
+			self.limiter.release()
+			self.stats.record( params.get( 'api' ), params.get( 'method' ), perf_counter() - start, error_code=type( e ).__name__ ) # failed calls are recorded with the exception type
+			raise
+
+		latency = perf_counter() - start
+		error_code = None if syno_response.success else ( syno_response.error_code or response.status_code )
+		self.limiter.observe( ticket, key, latency, response.status_code, syno_response.error_code, stream=stream )
+		if stream and syno_response.payload is None:
+			syno_response.release = self.limiter.release # streamed content still occupies the connection until consumed
+		else:
+			self.limiter.release()
+
+		self.stats.record(
+			params.get( 'api' ), params.get( 'method' ), latency,
+			bytes_out=request_size( response.request ),
+			bytes_in=int( response.headers.get( 'Content-Length', 0 ) ) if stream else len( response.content ),
+			error_code=error_code,
+		)
+
+		if debug:
+			log.debug( f'[dark_orange]Response:[/dark_orange] {response.status_code}' )
+			if syno_response.payload is not None:
+				log.debug( f'[dark_orange]Payload:[/dark_orange] {pretty_repr( syno_response.payload, max_depth=6 )}' )
+			elif stream:
+				log.debug( f'[dark_orange]Payload:[/dark_orange] <stream> length={response.headers.get( "Content-Length" )}' )
+			else:
+				log.debug( f'[dark_orange]Payload:[/dark_orange] <binary> length={len( response.content )}' )
 
-		return SynoResponse( response=response )
+		return syno_response
 
-	def get( self, url: str, template: Dict, **kwargs ) -> SynoResponse:
-		return self.req( get, url, template, **kwargs )
+	def get( self, url: str, template: Dict, stream: bool = False, headers: Optional[Dict] = None, **kwargs ) -> SynoResponse:
+		return self.req( self.transport.get, url, template, stream=stream, headers=headers, **kwargs )
 
-	def post( self, url: str, template: Dict, **kwargs ) -> SynoResponse:
-		return self.req( post, url, template, **kwargs )
+	def post( self, url: str, template: Dict, stream: bool = False, headers: Optional[Dict] = None, **kwargs ) -> SynoResponse:
+		return self.req( self.transport.post, url, template, stream=stream, headers=headers, **kwargs )
 
 	def get_url( self, stub: str ) -> str:
 		return stub.format( url=self.url )
 
+	def imap( self, fn: Callable[[T], R], iterable: Iterable[T] ) -> Iterator[R]:
+		"""
+		Applies fn to all elements of iterable with at most concurrency calls running at the same time.
+		Results are yielded in the order of the input elements, regardless of the order of completion.
+		"""
+		if self.concurrency <= 1:
+			yield from map( fn, iterable )
+		else:
+			with ThreadPoolExecutor( max_workers=self.concurrency ) as executor:
+				yield from executor.map( fn, iterable )
+
+	def pmap( self, fn: Callable[[T], R], iterable: Iterable[T] ) -> List[R]:
+		return list( self.imap( fn, iterable ) )
+
 	def login( self, ctx, otp_code: str = None ) -> SynoSession:
-		# todo: check if saved session has been expired, but unclear how to detect that
+		# reused sessions might have been expired on the server, this is detected and handled by req()
 		if self.session and self.session.is_valid():
 			log.info( f'reusing session with SID = {self.session.sid}, created at {self.session.updated_at}' )
 			return self.session
@@ -186,29 +407,56 @@ class SynoWebService:
 		self.session = self._login()
 		if not self.session.is_valid():
 			if self.session.error_code == 403:  # 2FA requested
+				from rich.prompt import Prompt
 				otp_token = Prompt.ask( 'Service responded with HTTP 403, 2FA seems to be enabled, please enter 2FA code' )
 				self.session = self._login( otp_token )
 				if not self.session.is_valid():
 					print_error( f'unable to log in: code={self.session.error_code}, msg={self.session.error_msg}' )
 					sysexit( -1 )
-				else:
-					log.info( f'created new session with SID = {self.session.sid}' )
 			else:
 				print_error( f'unable to log in: code={self.session.error_code}, msg={self.session.error_msg}' )
 				sysexit( -1 )
 
-		save_session = True  # todo: make this configurable?
-		#if save_session:
-		#	ctx.config.sessions[ctx.config.config.profile] = self.session
-		#	ctx.config.save_sessions()
+		log.info( f'created new session with SID = {self.session.sid}' )
+		if self.on_session:
+			self.on_session( self.session )
 
 		return self.session
 
+	def renew_session( self, sid: str ) -> bool:
+		"""
+		Replaces the session with the provided (rejected) session id by a new one. Concurrent callers wait for the first one
+		to log in again and then use its session. No 2FA code is asked for, as this may happen in the middle of a command:
+		if logging in fails, the rejected session is dropped (so that the next run logs in from scratch) and the command
+		is aborted.
+
+		:return: True if a valid session is available afterwards
+		"""
+		with self._session_lock:
+			if self.session_id != sid: # another thread has already renewed the session
+				return self.session is not None and self.session.is_valid()
+
+			session = self._login()
+			if not session.is_valid():
+				self.session = None
+				if self.on_session:
+					self.on_session( None )
+				hint = ', 2FA seems to be enabled, run the command again to enter a 2FA code' if session.error_code == 403 else ''
+				print_error( f'session has expired and logging in again failed: code={session.error_code}, msg={session.error_msg}{hint}' )
+				sysexit( -1 )
+
+			log.info( f'server rejected SID = {sid}, created new session with SID = {session.sid}' )
+			self.session = session
+			if self.on_session:
+				self.on_session( self.session )
+			return True
+
 	def _login( self, otp_code: str = None ) -> SynoSession:
+		# login requests never carry the (possibly rejected) current session id
 		if otp_code:
-			syno_response = self.get( ENTRY_URL, LOGIN_PARAMS, account=self.account, passwd=self.password, otp_code=otp_code )
+			syno_response = self._req( self.transport.get, ENTRY_URL, LOGIN_PARAMS, None, account=self.account, passwd=self.password, otp_code=otp_code )
 		else:
-			syno_response = self.get( ENTRY_URL, LOGIN_PARAMS, account=self.account, passwd=self.password )
+			syno_response = self._req( self.transport.get, ENTRY_URL, LOGIN_PARAMS, None, account=self.account, passwd=self.password )
 
 		if syno_response.success:
 			return conv.structure_attrs_fromdict( {**syno_response.data, 'updated_at': datetime.utcnow().isoformat()}, SynoSession )
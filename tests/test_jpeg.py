@@ -0,0 +1,182 @@
+from fractions import Fraction
+from io import BytesIO
+from struct import Struct
+from typing import Dict, List, Tuple
+
+from pytest import mark
+
+from synophotos.exif import exif_header, SynoExif
+from synophotos.jpeg import ExifTags, MAX_SEGMENT_LENGTH, read_header
+from synophotos.photos import Item
+
+# test files are assembled from single segments, exif data is parsed independently of synophotos.jpeg
+
+SOI, EOI = b'\xff\xd8', b'\xff\xd9'
+APP0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+SOS = b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00'
+IMAGE_DATA = bytes( range( 256 ) ) * 64 + b'\xff\x00\xff\xd0' # scan data with stuffed bytes and restart markers
+
+ASCII, SHORT, LONG, RATIONAL = 2, 3, 4, 5
+MAKE, MODEL, EXIF_POINTER, GPS_POINTER, EXPOSURE_TIME = 0x010F, 0x0110, 0x8769, 0x8825, 0x829A
+DATETIME, DATETIME_ORIGINAL, GPS_LATITUDE_REF, GPS_LATITUDE, IMAGE_DESCRIPTION = 0x0132, 0x9003, 0x0001, 0x0002, 0x010E
+
+Entry = Tuple[int, int, int, bytes] # tag, type, count, value (in the byte order of the file)
+
+def jpeg( *segments: bytes ) -> bytes:
+	return SOI + b''.join( segments ) + SOS + IMAGE_DATA + EOI
+
+def app1( tiff: bytes ) -> bytes:
+	return b'\xff\xe1' + Struct( '>H' ).pack( 2 + 6 + len( tiff ) ) + b'Exif\x00\x00' + tiff
+
+def ascii_entry( tag: int, value: str ) -> Entry:
+	return tag, ASCII, len( value ) + 1, value.encode() + b'\x00'
+
+def tiff( order: str, ifd0: List[Entry], exif: List[Entry] ) -> bytes:
+	# header, ifd0, exif ifd, values of both ifds
+	header_size, ifd0_size, exif_size = 8, 2 + 12 * ( len( ifd0 ) + 1 ) + 4, 2 + 12 * len( exif ) + 4
+	data_offset, data = header_size + ifd0_size + exif_size, bytearray()
+
+	def pack_ifd( entries: List[Entry], next_ifd: int ) -> bytes:
+		nonlocal data_offset
+		raw = [ Struct( f'{order}H' ).pack( len( entries ) ) ]
+		for tag, ftype, count, value in sorted( entries ):
+			if len( value ) > 4:
+				raw.append( Struct( f'{order}HHII' ).pack( tag, ftype, count, data_offset + len( data ) ) )
+				data.extend( value + b'\x00' * ( len( value ) % 2 ) )
+			else:
+				raw.append( Struct( f'{order}HHI' ).pack( tag, ftype, count ) + value.ljust( 4, b'\x00' ) )
+		raw.append( Struct( f'{order}I' ).pack( next_ifd ) )
+		return b''.join( raw )
+
+	pointer = ( EXIF_POINTER, LONG, 1, Struct( f'{order}I' ).pack( header_size + ifd0_size ) )
+	head = ( b'II' if order == '<' else b'MM' ) + Struct( f'{order}HI' ).pack( 42, header_size )
+	ifds = pack_ifd( [ *ifd0, pointer ], 0 ) + pack_ifd( exif, 0 )
+	return head + ifds + bytes( data )
+
+def parse( content: bytes ) -> Tuple[str, Dict[str, Dict[int, object]], int]:
+	# returns byte order, values of ifd0/exif/gps ifds and the offset of the first byte after the exif segment
+	offset = 2
+	while content[offset + 1] != 0xE1:
+		offset += 2 + Struct( '>H' ).unpack_from( content, offset + 2 )[0]
+	length = Struct( '>H' ).unpack_from( content, offset + 2 )[0]
+	assert content[offset + 4:offset + 10] == b'Exif\x00\x00'
+	data = content[offset + 10:offset + 2 + length]
+	order = { b'II': '<', b'MM': '>' }[data[:2]]
+	assert Struct( f'{order}H' ).unpack_from( data, 2 )[0] == 42
+
+	def read_ifd( ifd_offset: int ) -> Dict[int, object]:
+		values = {}
+		for i in range( Struct( f'{order}H' ).unpack_from( data, ifd_offset )[0] ):
+			tag, ftype, count = Struct( f'{order}HHI' ).unpack_from( data, ifd_offset + 2 + 12 * i )
+			size = { ASCII: 1, SHORT: 2, LONG: 4, RATIONAL: 8 }.get( ftype, 1 ) * count
+			value_offset = ifd_offset + 2 + 12 * i + 8 if size <= 4 else Struct( f'{order}I' ).unpack_from( data, ifd_offset + 2 + 12 * i + 8 )[0]
+			raw = data[value_offset:value_offset + size]
+			assert len( raw ) == size, f'value of tag {tag:#x} exceeds exif data'
+			if ftype == ASCII:
+				values[tag] = raw.rstrip( b'\x00' ).decode()
+			elif ftype in [ SHORT, LONG ]:
+				values[tag] = Struct( f'{order}{count}{"H" if ftype == SHORT else "I"}' ).unpack( raw )
+			elif ftype == RATIONAL:
+				values[tag] = tuple( Fraction( *Struct( f'{order}II' ).unpack_from( raw, 8 * i ) ) for i in range( count ) )
+			else:
+				values[tag] = bytes( raw )
+		return values
+
+	ifd0 = read_ifd( Struct( f'{order}I' ).unpack_from( data, 4 )[0] )
+	ifds = { 'ifd0': ifd0 }
+	for name, pointer in [ ( 'exif', EXIF_POINTER ), ( 'gps', GPS_POINTER ) ]:
+		ifds[name] = read_ifd( ifd0[pointer][0] ) if pointer in ifd0 else {}
+	return order, ifds, offset + 2 + length
+
+def existing( order: str ) -> bytes:
+	exposure = Struct( f'{order}II' ).pack( 1, 250 )
+	return jpeg( APP0, app1( tiff( order, [ ascii_entry( MAKE, 'Maker' ), ascii_entry( MODEL, 'Model 1' ) ], [ ( EXPOSURE_TIME, RATIONAL, 1, exposure ) ] ) ) )
+
+def tags() -> ExifTags:
+	t = ExifTags()
+	t.set( 'datetime', '2022:01:30 16:50:46' )
+	t.set( 'datetime_original', '2022:01:30 16:50:46' )
+	t.set( 'gps_latitude', ( 52.0, 30.0, 31.5 ) )
+	t.set( 'gps_latitude_ref', 'N' )
+	return t
+
+def assert_image_data( original: bytes, result: bytes ) -> None:
+	assert result.endswith( SOS + IMAGE_DATA + EOI )
+	assert len( result ) - len( original ) == len( read_header( BytesIO( result ) ) ) - len( read_header( BytesIO( original ) ) )
+
+@mark.parametrize( 'order', [ '<', '>' ] )
+def test_existing_exif( order: str ):
+	content = existing( order )
+	result = tags().apply( content )
+
+	parsed_order, ifds, end = parse( result )
+	assert parsed_order == order
+	assert result[:len( SOI + APP0 )] == SOI + APP0
+	assert result[end:] == SOS + IMAGE_DATA + EOI
+
+	# existing values are kept
+	assert ifds['ifd0'][MAKE] == 'Maker'
+	assert ifds['ifd0'][MODEL] == 'Model 1'
+	assert ifds['exif'][EXPOSURE_TIME] == ( Fraction( 1, 250 ), )
+
+	# new values are added
+	assert ifds['ifd0'][DATETIME] == '2022:01:30 16:50:46'
+	assert ifds['exif'][DATETIME_ORIGINAL] == '2022:01:30 16:50:46'
+	assert ifds['gps'][GPS_LATITUDE_REF] == 'N'
+	assert ifds['gps'][GPS_LATITUDE] == ( Fraction( 52 ), Fraction( 30 ), Fraction( 63, 2 ) )
+	assert_image_data( content, result )
+
+@mark.parametrize( 'order', [ '<', '>' ] )
+def test_apply_twice( order: str ):
+	result = tags().apply( tags().apply( existing( order ) ) )
+	assert parse( result )[1]['ifd0'][MAKE] == 'Maker'
+	assert parse( result )[1]['gps'][GPS_LATITUDE] == ( Fraction( 52 ), Fraction( 30 ), Fraction( 63, 2 ) )
+
+def test_jfif_without_exif():
+	content = jpeg( APP0 )
+	result = tags().apply( content )
+
+	order, ifds, end = parse( result )
+	assert result.startswith( SOI + APP0 + b'\xff\xe1' ) # exif segment is inserted after APP0
+	assert result[end:] == SOS + IMAGE_DATA + EOI
+	assert ifds['ifd0'][DATETIME] == '2022:01:30 16:50:46'
+	assert ifds['gps'][GPS_LATITUDE] == ( Fraction( 52 ), Fraction( 30 ), Fraction( 63, 2 ) )
+
+def test_gps_rationals():
+	t = ExifTags()
+	t.set( 'gps_latitude', ( 55.0, 32.0, 59.999 ) )
+	t.set( 'gps_longitude', ( 8, 53, 17.25 ) )
+	t.set( 'gps_latitude_ref', 'S' )
+	t.set( 'gps_longitude_ref', 'W' )
+	gps = parse( t.apply( jpeg( APP0 ) ) )[1]['gps']
+
+	assert gps[0x0000] == b'\x02\x02\x00\x00' # gps version is added automatically
+	assert gps[GPS_LATITUDE] == ( Fraction( 55 ), Fraction( 32 ), Fraction( 59999, 1000 ) )
+	assert gps[0x0004] == ( Fraction( 8 ), Fraction( 53 ), Fraction( 69, 4 ) )
+	assert ( gps[GPS_LATITUDE_REF], gps[0x0003] ) == ( 'S', 'W' )
+
+def test_segment_too_large():
+	content = jpeg( APP0, app1( tiff( '<', [ ascii_entry( IMAGE_DESCRIPTION, 'x' * ( MAX_SEGMENT_LENGTH - 200 ) ) ], [] ) ) )
+	t = ExifTags()
+	t.set( 'image_description', 'y' * 1000 )
+	assert t.apply( content ) == content # content is left unchanged instead of writing a broken length field
+
+def test_not_a_jpeg( tmp_path ):
+	content = b'\x89PNG\r\n\x1a\n' + bytes( 100 )
+	assert tags().apply( content ) == content
+	assert read_header( BytesIO( content ) ) == b''
+
+	path = tmp_path / 'image.png'
+	path.write_bytes( content )
+	assert exif_header( str( path ), SynoExif(), Item( id=1, filename='image.png', time=0 ) ) is None
+
+def test_exif_header( tmp_path ):
+	content = existing( '>' )
+	path = tmp_path / 'image.jpg'
+	path.write_bytes( content )
+
+	length, header = exif_header( str( path ), SynoExif( data={ 'Date and Time': '2022:01:30 16:50:46' } ), Item( id=1, filename='image.jpg', time=0 ) )
+	assert length == len( content ) - len( SOS + IMAGE_DATA + EOI )
+	ifds = parse( header + content[length:] )[1]
+	assert ifds['ifd0'][MAKE] == 'Maker'
+	assert ifds['ifd0'][DATETIME] == '2022:01:30 16:50:46'